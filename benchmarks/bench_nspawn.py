@@ -0,0 +1,124 @@
+"""
+HTTP round trips and latency of the nspawn client, measured against the
+fake machine API (no nspawn host needed)::
+
+    python benchmarks/bench_nspawn.py --latency 0.005 --count 10
+
+Prints, for every case, the wall time and the machine API requests per
+operation, then the latency of `run(stream=True)` to the first line and to
+the end of the output.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import py
+
+# the fake engines are test tooling, they live with the tests
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+from fakeengine import FakeNspawn
+
+
+def build(tmpdir, conf_type='minion'):
+    from saltcontainers.factories import ContainerFactory
+    return ContainerFactory(
+        type='nspawn',
+        config__image='fake/image',
+        config__salt_config__tmpdir=tmpdir,
+        config__salt_config__conf_type=conf_type)
+
+
+def bench_build(machines, tmpdir, count):
+    for _ in range(count):
+        build(tmpdir)
+
+
+def bench_configure_salt(machines, tmpdir, count):
+    container = build(tmpdir)
+    machines.reset()
+    for _ in range(count):
+        container['config']['client'].configure_salt(container['config'])
+
+
+def bench_master(machines, tmpdir, count):
+    from saltcontainers.factories import MasterFactory
+    for _ in range(count):
+        MasterFactory(
+            container__type='nspawn',
+            container__config__image='fake/image',
+            container__config__salt_config__tmpdir=tmpdir,
+            container__config__salt_config__conf_type='master')
+
+
+def bench_drop(machines, tmpdir, count):
+    containers = [build(tmpdir) for _ in range(count)]
+    machines.reset()
+    for container in containers:
+        container['config']['client'].drop(container['config']['name'])
+
+
+CASES = [
+    ('ContainerFactory', bench_build),
+    ('configure_salt', bench_configure_salt),
+    ('MasterFactory', bench_master),
+    ('drop', bench_drop),
+]
+
+
+def stream_latency(machines, tmpdir, count):
+    """
+    Seconds to the first line and to the end of `run(stream=True)`.
+    """
+    container = build(tmpdir)
+    first, total = [], []
+    for _ in range(count):
+        start = time.time()
+        lines = container.run('salt-call --version', stream=True)
+        next(lines)
+        first.append(time.time() - start)
+        for _ in lines:
+            pass
+        total.append(time.time() - start)
+    return min(first), min(total)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every machine API request')
+    parser.add_argument('--count', type=int, default=5,
+                        help='operations per case')
+    parser.add_argument('--stop-delay', type=float, default=0.2,
+                        help='seconds a machine takes to stop')
+    args = parser.parse_args(argv)
+
+    results = []
+    with FakeNspawn(
+            latency=args.latency, stop_delay=args.stop_delay) as machines:
+        os.environ['NSPAWN_HOST'] = machines.url
+        for name, case in CASES:
+            tmpdir = py.path.local(tempfile.mkdtemp(prefix='bench-'))
+            machines.reset()
+            start = time.time()
+            case(machines, tmpdir, args.count)
+            results.append((name, time.time() - start, machines.stats()))
+        first, total = stream_latency(
+            machines, py.path.local(tempfile.mkdtemp(prefix='bench-')),
+            args.count)
+
+    sys.stdout.write('\n{0:<20} {1:>10} {2:>10} {3:>10}\n'.format(
+        'case', 'wall(s)', 'req/op', 'runs/op'))
+    for name, wall, stats in results:
+        sys.stdout.write('{0:<20} {1:>10.3f} {2:>10.1f} {3:>10.1f}\n'.format(
+            name, wall, stats['total'] / float(args.count),
+            stats.get('run', 0) / float(args.count)))
+    sys.stdout.write(
+        '\nrun(stream=True): first line {0:.4f}s, complete {1:.4f}s\n'.format(
+            first, total))
+    return results, (first, total)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Setup cost of the factories and of the `setup` fixture, measured against
+the fake docker engine (no docker needed)::
+
+    python benchmarks/bench_setup.py --latency 0.005 --rounds 3
+
+Prints the wall time and the number of engine requests of every case.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import textwrap
+import py
+import pytest
+from saltcontainers.networks import networks
+from saltcontainers.reaper import reaper
+
+# the fake engines are test tooling, they live with the tests
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+from fakeengine import FakeEngine
+
+
+SETUP_MODULE = textwrap.dedent("""
+    import pytest
+
+
+    @pytest.fixture(scope="module")
+    def module_config():
+        return {{
+            "masters": [
+                {{"minions": [{{}} for _ in range({minions})]}}
+                for _ in range({masters})
+            ]
+        }}
+
+
+    def test_setup(setup):
+        config, _ = setup
+        assert len(config['masters']) == {masters}
+""")
+
+SETUP_INI = textwrap.dedent("""
+    [pytest]
+    IMAGE = fake/image
+    STATIC_IPS = {static_ips}
+""")
+
+
+def salt_config(tmpdir, conf_type, **extra):
+    kwargs = dict(
+        container__config__image='fake/image',
+        container__config__salt_config__tmpdir=tmpdir,
+        container__config__salt_config__conf_type=conf_type)
+    kwargs.update(extra)
+    return kwargs
+
+
+def bench_container(tmpdir, count):
+    from saltcontainers.factories import ContainerFactory
+    for _ in range(count):
+        ContainerFactory(
+            config__image='fake/image',
+            config__salt_config__tmpdir=tmpdir,
+            config__salt_config__conf_type='minion').remove()
+
+
+def bench_master(tmpdir, count):
+    from saltcontainers.factories import MasterFactory
+    for _ in range(count):
+        MasterFactory(**salt_config(tmpdir, 'master'))['container'].remove()
+
+
+def bench_minion(tmpdir, count):
+    from saltcontainers.factories import MasterFactory, MinionFactory
+    master = MasterFactory(**salt_config(tmpdir, 'master'))
+    for _ in range(count):
+        MinionFactory(**salt_config(
+            tmpdir, 'minion',
+            container__config__salt_config__config={
+                'base_config': {'master': master['container']['ip']}})
+        )['container'].remove()
+    master['container'].remove()
+
+
+def bench_setup(tmpdir, count):
+    root = tmpdir.mkdir('setup')
+    root.join('test_setup.py').write(SETUP_MODULE.format(masters=1, minions=count))
+    root.join('pytest.ini').write(SETUP_INI.format(static_ips=networks.static_ips))
+    code = pytest.main([root.strpath, '-q', '-p', 'no:cacheprovider'])
+    assert code == 0, 'setup benchmark failed'
+
+
+CASES = [
+    ('ContainerFactory', bench_container),
+    ('MasterFactory', bench_master),
+    ('MinionFactory', bench_minion),
+    ('setup fixture', bench_setup),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every engine request')
+    parser.add_argument('--count', type=int, default=5,
+                        help='containers (or minions) built per case')
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--static-ips', action='store_true',
+                        help='create containers with pre-allocated addresses')
+    args = parser.parse_args(argv)
+    networks.static_ips = args.static_ips
+
+    results = []
+    with FakeEngine(latency=args.latency) as engine:
+        os.environ['DOCKER_HOST'] = engine.url
+        for name, case in CASES:
+            for _ in range(args.rounds):
+                tmpdir = py.path.local(tempfile.mkdtemp(prefix='bench-'))
+                engine.reset()
+                networks.clear()
+                start = time.time()
+                case(tmpdir, args.count)
+                reaper.drain()
+                results.append((name, time.time() - start, engine.stats()))
+
+    sys.stdout.write('\n{0:<20} {1:>10} {2:>10} {3:>10}\n'.format(
+        'case', 'wall(s)', 'requests', 'execs'))
+    for name, wall, stats in results:
+        sys.stdout.write('{0:<20} {1:>10.3f} {2:>10} {3:>10}\n'.format(
+            name, wall, stats['total'], stats.get('exec_start', 0)))
+    return results
+
+
+if __name__ == '__main__':
+    main()
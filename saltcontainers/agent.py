@@ -0,0 +1,128 @@
+import re
+import time
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+from six.moves import shlex_quote
+from .utils import ExecResult, TIME_LIMIT, iter_frames
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+STDOUT = 1
+STDERR = 2
+
+
+class ExecAgent(object):
+    """
+    Run commands in a container through one long-lived `/bin/sh` exec.
+
+    Each command is written to the shell's stdin followed by markers carrying
+    its id and exit code on stdout and stderr. A reader thread demultiplexes
+    the attached docker stream and resolves the futures of the commands in
+    order, so several commands can be in flight at once.
+    """
+
+    enabled = False
+
+    command = (
+        "( eval {command} ) </dev/null; "
+        "printf '\\n__sc_{id}_%d__\\n' $?; "
+        "printf '\\n__sc_{id}__\\n' >&2\n"
+    )
+
+    def __init__(self, container):
+        self.container = container
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.out = b''
+        self.err = b''
+        self.sock = None
+        self.closed = False
+
+    @staticmethod
+    def supported(container):
+        return hasattr(container['config']['client'], 'exec_create')
+
+    def start(self):
+        client = self.container['config']['client']
+        cmd_exec = client.exec_create(
+            self.container['config']['name'], cmd='/bin/sh',
+            stdin=True, stdout=True, stderr=True)
+        sock = client.exec_start(cmd_exec['Id'], socket=True)
+        self.sock = getattr(sock, '_sock', sock)
+        # the client timeout applies to the hijacked socket too, an idle
+        # shell must not end the agent
+        self.sock.settimeout(None)
+        thread = threading.Thread(target=self.follow)
+        thread.daemon = True
+        thread.start()
+
+    def follow(self):
+        try:
+            for stream, data in iter_frames(self.sock):
+                with self.lock:
+                    if stream == STDERR:
+                        self.err += data
+                    else:
+                        self.out += data
+                    self.resolve()
+        except Exception as exc:
+            logger.debug(exc)
+        finally:
+            self.close()
+
+    def resolve(self):
+        while self.pending:
+            cmd_id, future, start = self.pending[0]
+            out = re.search(
+                '\n__sc_{0}_(\\d+)__\n'.format(cmd_id).encode('utf8'), self.out)
+            err = re.search(
+                '\n__sc_{0}__\n'.format(cmd_id).encode('utf8'), self.err)
+            if not (out and err):
+                return
+            self.pending.popleft()
+            result = ExecResult(
+                exit_code=int(out.group(1)),
+                stdout=self.out[:out.start()],
+                stderr=self.err[:err.start()],
+                duration=time.time() - start)
+            self.out = self.out[out.end():]
+            self.err = self.err[err.end():]
+            future.set_result(result)
+
+    def submit(self, command):
+        """
+        Send `command` to the shell, return a future of its ExecResult.
+        """
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise EOFError('exec agent stream closed')
+            cmd_id = next(self.ids)
+            self.pending.append((cmd_id, future, time.time()))
+            self.sock.sendall(
+                self.command.format(
+                    command=shlex_quote(command), id=cmd_id).encode('utf8'))
+        return future
+
+    def run(self, command, timeout=TIME_LIMIT):
+        return self.submit(command).result(timeout=timeout)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending, self.pending = self.pending, deque()
+            try:
+                self.sock.sendall(b'exit\n')
+                self.sock.close()
+            except Exception as exc:
+                logger.debug(exc)
+        for _, future, _ in pending:
+            future.set_exception(EOFError('exec agent stream closed'))
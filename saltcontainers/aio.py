@@ -0,0 +1,304 @@
+"""
+asyncio flavour of the container and salt models (python 3.5+ only).
+
+Containers are still built by the regular factories (off the event loop),
+the commands sent to them afterwards go over plain HTTP on the engine unix
+socket without a thread per call, so many of them can be gathered at once.
+"""
+import io
+import py
+import json
+import shlex
+import tarfile
+import struct
+import asyncio
+import logging
+from functools import partial
+from urllib.parse import quote, unquote, urlencode
+from .utils import TIME_LIMIT, load_json
+from .clients import DockerClient, NspawnClient
+from .connections import socket_path
+from .factories import ContainerFactory, MasterFactory, MinionFactory
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+STDOUT = 1
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, body):
+        super(HTTPError, self).__init__(
+            '{0}: {1}'.format(status, body.decode('utf8', 'replace')))
+        self.status = status
+        self.body = body
+
+
+class UnixTransport(object):
+    """
+    Minimal HTTP/1.1 client over a unix socket, one connection per request.
+    """
+
+    def __init__(self, path, timeout=TIME_LIMIT):
+        self.path = path
+        self.timeout = timeout
+
+    async def request(self, method, url, body=None, headers=None):
+        return await asyncio.wait_for(
+            self._request(method, url, body, headers or {}), self.timeout)
+
+    async def _request(self, method, url, body, headers):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        try:
+            body = body or b''
+            head = ['{0} {1} HTTP/1.1'.format(method, url),
+                    'Host: localhost',
+                    'Connection: close',
+                    'Content-Length: {0}'.format(len(body))]
+            head.extend('{0}: {1}'.format(k, v) for k, v in headers.items())
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin1') + body)
+            await writer.drain()
+            return await self.response(reader)
+        finally:
+            writer.close()
+
+    async def response(self, reader):
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin1').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+        if status >= 400:
+            raise HTTPError(status, body)
+        return body
+
+
+def demux(data, streams=(STDOUT,)):
+    """
+    Join the frames of a multiplexed docker stream belonging to `streams`.
+    """
+    out = b''
+    while len(data) >= 8:
+        stream, size = struct.unpack('>BxxxL', data[:8])
+        if stream in streams:
+            out += data[8:8 + size]
+        data = data[8 + size:]
+    return out
+
+
+class AsyncDockerClient(object):
+
+    def __init__(self, base_url='unix://var/run/docker.sock', version='1.22',
+                 timeout=TIME_LIMIT):
+        self.transport = UnixTransport(socket_path(base_url), timeout=timeout)
+        self.version = version
+
+    async def call(self, method, path, data=None, **params):
+        url = '/v{0}{1}'.format(self.version, path)
+        if params:
+            url += '?' + urlencode(params)
+        headers = {}
+        body = None
+        if isinstance(data, bytes):
+            headers['Content-Type'] = 'application/x-tar'
+            body = data
+        elif data is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(data).encode('utf8')
+        return await self.transport.request(method, url, body, headers)
+
+    async def run(self, name, command):
+        cmd_exec = json.loads((await self.call(
+            'POST', '/containers/{0}/exec'.format(quote(name)),
+            dict(Cmd=shlex.split(command), AttachStdin=False,
+                 AttachStdout=True, AttachStderr=False, Tty=False))).decode('utf8'))
+        raw = await self.call(
+            'POST', '/exec/{0}/start'.format(cmd_exec['Id']),
+            dict(Detach=False, Tty=False))
+        return demux(raw)
+
+    async def start(self, name):
+        await self.call('POST', '/containers/{0}/start'.format(quote(name)))
+
+    async def force_remove(self, name):
+        await self.call(
+            'DELETE', '/containers/{0}'.format(quote(name)), v=1, force=1)
+
+    async def put_archive(self, name, path, data):
+        await self.call(
+            'PUT', '/containers/{0}/archive'.format(quote(name)), data, path=path)
+
+
+class AsyncNspawnClient(object):
+
+    def __init__(self, base_url='http+unix:///var/run/gunicorn.sock',
+                 timeout=TIME_LIMIT):
+        self.transport = UnixTransport(
+            unquote(base_url.replace('http+unix://', '')), timeout=timeout)
+
+    async def call(self, method, path, **data):
+        return await self.transport.request(
+            method, path, urlencode(data).encode('utf8'),
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    async def run(self, name, command):
+        resp = await self.call('POST', '/run', machine=name, command=command)
+        return json.loads(resp.decode('utf8'))['stdoutdata']
+
+    async def start(self, name):
+        await self.call('POST', '/start', machine=name)
+
+    async def force_remove(self, name):
+        await self.call('POST', '/stop', machine=name)
+        await self.call('DELETE', '/remove', machine=name)
+
+    async def copy_to(self, name, source, target):
+        await self.call(
+            'POST', '/copy-to', machine=name, source=source, target=target)
+
+
+def async_client_for(client):
+    """
+    The asyncio counterpart of a blocking client.
+    """
+    if isinstance(client, NspawnClient):
+        return AsyncNspawnClient(client.base_url)
+    if isinstance(client, DockerClient) and client.url:
+        return AsyncDockerClient(client.url, version=client.api_version)
+    return AsyncDockerClient()
+
+
+class AsyncContainer(object):
+    """
+    Awaitable operations on a container built by ContainerFactory.
+    """
+
+    def __init__(self, container, client=None):
+        self.container = container
+        self.client = client or async_client_for(container['config']['client'])
+
+    def __getitem__(self, key):
+        return self.container[key]
+
+    @property
+    def name(self):
+        return self.container['config']['name']
+
+    async def run(self, command):
+        return await self.client.run(self.name, command)
+
+    async def start(self):
+        await self.client.start(self.name)
+
+    async def copy_to(self, source, target):
+        if isinstance(self.client, AsyncNspawnClient):
+            return await self.client.copy_to(self.name, source, target)
+        source = py.path.local(source)
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as archive:
+            archive.add(source.strpath, arcname=source.basename)
+        await self.client.put_archive(self.name, target, buf.getvalue())
+
+    async def remove(self):
+        """
+        Remove the container like the fixtures do (events and agent stopped,
+        then pool or reaper), in the loop's executor. The fixture finalizer
+        then finds it removed.
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.container.remove)
+
+
+class AsyncBase(object):
+
+    def __init__(self, model):
+        self.model = model
+        self.container = AsyncContainer(model['container'])
+
+    def __getitem__(self, key):
+        return self.model[key]
+
+    async def salt_call(self, salt_command, *args):
+        command = "salt-call {0} {1} --output=json -l quiet".format(
+            salt_command, ' '.join(args)
+        )
+        raw = await self.container.run(command)
+        try:
+            out = json.loads(raw or '{}')
+        except ValueError:
+            raise Exception(raw)
+        return out.get('local')
+
+    async def start(self):
+        await self.container.run(self.model['cmd'])
+
+    async def remove(self):
+        await self.container.remove()
+
+
+class AsyncMaster(AsyncBase):
+
+    async def salt_key_raw(self, *args):
+        command = ['salt-key']
+        command.extend(args)
+        command.append('--output=json')
+        return await self.container.run(' '.join(command))
+
+    async def salt_key(self, *args):
+        return json.loads(await self.salt_key_raw(*args))
+
+    async def salt_key_accept(self, minion_id):
+        return await self.salt_key_raw('-a', minion_id, '-y')
+
+    async def salt(self, minion_id, salt_command, *args):
+        command = "salt {0} {1} --output=json -l quiet".format(
+            minion_id, salt_command, ' '.join(args))
+        return load_json(await self.container.run(command))
+
+    async def salt_run(self, command, *args):
+        command = "salt-run {0} {1} --output=json -l quiet".format(
+            command, ' '.join(args))
+        return load_json(await self.container.run(command))
+
+
+class AsyncMinion(AsyncBase):
+
+    async def stop(self):
+        await self.container.run('pkill salt-minion')
+
+
+class AsyncFactory(object):
+    """
+    Run a blocking factory in the loop's executor and wrap what it builds.
+    """
+
+    def __init__(self, factory, wrapper):
+        self.factory = factory
+        self.wrapper = wrapper
+
+    async def __call__(self, **kwargs):
+        loop = asyncio.get_event_loop()
+        obj = await loop.run_in_executor(None, partial(self.factory, **kwargs))
+        return self.wrapper(obj)
+
+
+AsyncContainerFactory = AsyncFactory(ContainerFactory, AsyncContainer)
+AsyncMasterFactory = AsyncFactory(MasterFactory, AsyncMaster)
+AsyncMinionFactory = AsyncFactory(MinionFactory, AsyncMinion)
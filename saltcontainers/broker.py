@@ -0,0 +1,100 @@
+import json
+import time
+import fcntl
+import hashlib
+import logging
+from contextlib import contextmanager
+from .utils import RetryPolicy
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+LEASE_TIME_LIMIT = 900
+
+
+def fingerprint(*parts):
+    """
+    Canonical digest of a topology description (module_config, factory
+    kwargs, images...).
+    """
+    return hashlib.sha1(
+        json.dumps(parts, sort_keys=True, default=repr).encode('utf8')
+    ).hexdigest()
+
+
+class TopologyBroker(object):
+    """
+    Share topologies between the processes of a session (xdist workers).
+
+    The state lives in a JSON file next to `path` guarded by an exclusive
+    file lock. The first worker asking for a fingerprint builds it while the
+    others wait, every lease takes a reference and the worker releasing the
+    last one tears the topology down.
+    """
+
+    def __init__(self, path, policy=None):
+        self.path = path
+        self.lock_path = path.dirpath(path.basename + '.lock')
+        self.policy = policy or RetryPolicy(
+            deadline=LEASE_TIME_LIMIT, interval=0.5, max_interval=5)
+
+    @contextmanager
+    def state(self):
+        with open(self.lock_path.strpath, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = json.loads(self.path.read()) if self.path.check() else {}
+                yield state
+                self.path.write(json.dumps(state))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def lease(self, key, build, owner):
+        """
+        Return the topology stored under `key`, calling `build` to create it
+        when no worker did yet. `build` returns JSON serializable data.
+        """
+        delays = self.policy.delays()
+        start_time = time.time()
+        while True:
+            with self.state() as state:
+                entry = state.get(key)
+                if entry is None:
+                    state[key] = dict(status='building', owner=owner, refs=0)
+                    break
+                if entry['status'] == 'ready':
+                    entry['refs'] += 1
+                    return entry['topology']
+            if self.policy.expired(start_time):
+                raise RuntimeError(
+                    'Timed out waiting for {0} to build topology {1}'.format(
+                        entry['owner'], key))
+            time.sleep(next(delays))
+
+        try:
+            topology = build()
+        except Exception:
+            with self.state() as state:
+                state.pop(key, None)
+            raise
+
+        with self.state() as state:
+            state[key] = dict(
+                status='ready', owner=owner, refs=1, topology=topology)
+        return topology
+
+    def release(self, key, teardown):
+        """
+        Drop a reference to `key`, calling `teardown` with the topology when
+        it was the last one.
+        """
+        with self.state() as state:
+            entry = state.get(key)
+            if entry is None:
+                return
+            entry['refs'] -= 1
+            if entry['refs'] > 0:
+                return
+            state.pop(key)
+        teardown(entry['topology'])
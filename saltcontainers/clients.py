@@ -1,29 +1,89 @@
+import os
 import py
+import re
 import time
-import urllib
 import subprocess
 import tarfile
 import tempfile
 import logging
+import requests
 import requests_unixsocket
 from functools import wraps
 from docker import Client
+from six.moves import shlex_quote
+from six.moves.urllib.parse import quote_plus
+from .renderer import renderer
+from .utils import ExecResult, iter_frames, wait_for
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+STDERR = 2
+EXIT_MARKER = re.compile(b'\n__sc_exit_(\\d+)__\n?$')
+STOPPED = ('stopped', 'gone')
+STOP_DEADLINE = 30
+
+
+def pack_salt_config(config):
+    """
+    Pack the salt config tree into a single tar archive at `conf_path`.
+    """
+    conf_path = config['salt_config']['conf_path']
+    with conf_path.open('wb') as f:
+        renderer.write(config['salt_config'], f)
+    return conf_path
+
+
 class DockerClient(Client):
     """ """
 
+    def __init__(self, base_url=None, *args, **kwargs):
+        super(DockerClient, self).__init__(base_url, *args, **kwargs)
+        # docker-py turns unix URLs into http+docker://localunixsocket
+        self.url = base_url
+
     def start(self, config):
         return super(DockerClient, self).start(config['name'])
 
+    def use_adapter(self, adapter):
+        self._custom_adapter = adapter
+        self.mount('http+docker://', adapter)
+
     def run(self, name, command, stream=None):
         cmd_exec = self.exec_create(name, cmd=command, stderr=False)
         return self.exec_start(cmd_exec['Id'], stream=stream)
 
+    def execute(self, name, command):
+        """
+        Run `command` and return its ExecResult (exit code, stdout, stderr).
+        """
+        start_time = time.time()
+        cmd_exec = self.exec_create(name, cmd=command)
+        # Client internals, docker-py is pinned in setup.py for them. The
+        # public exec_start either merges stdout and stderr (stream=True) or
+        # hands out the socket under http.client's buffered reader
+        # (socket=True), which may already hold the first frames.
+        resp = self._post_json(
+            self._url('/exec/{0}/start', cmd_exec['Id']),
+            data=dict(Tty=False, Detach=False), stream=True)
+        self._raise_for_status(resp)
+        out, err = [], []
+        try:
+            for stream, data in iter_frames(resp.raw):
+                (err if stream == STDERR else out).append(data)
+        finally:
+            resp.close()
+        return ExecResult(
+            exit_code=self.exec_inspect(cmd_exec['Id'])['ExitCode'],
+            stdout=b''.join(out),
+            stderr=b''.join(err),
+            duration=time.time() - start_time)
+
+    def force_remove(self, name):
+        self.remove_container(name, v=True, force=True)
+
     def drop(self, name):
         proc = subprocess.Popen(
             'docker rm -f {0} > /dev/null'.format(name), shell=True)
@@ -34,17 +94,11 @@ class DockerClient(Client):
             logger.debug(out)
 
     def configure_salt(self, config):
-        conf_path = config['salt_config']['conf_path']
-
-        with tarfile.open(conf_path.strpath, mode='w') as archive:
-            root = config['salt_config']['root']
-            for item in root.listdir():
-                archive.add(
-                    item.strpath,
-                    arcname=item.strpath.replace(root.strpath, '.'))
-
-        with conf_path.open('rb') as f:
-            self.put_archive(config['name'], '/etc/salt', f.read())
+        archive = renderer.archive(config['salt_config'])
+        try:
+            self.put_archive(config['name'], '/etc/salt', archive)
+        finally:
+            archive.close()
 
     def getip(self, machine):
         return self.inspect_container(machine)['NetworkSettings']['Networks'].popitem()[1]['IPAddress']
@@ -68,13 +122,16 @@ class NspawnClient(object):
         self.session = requests_unixsocket.Session()
         if base_url.startswith("http+unix"):
             self.base_url = "http+unix://{0}".format(
-                urllib.quote_plus(base_url.replace('http+unix://', '')))
+                quote_plus(base_url.replace('http+unix://', '')))
         else:
             self.base_url = base_url
         # self.session.get = self.wrapper(self.session.get)
         self.session.post = self.wrapper(self.session.post)
         self.session.delete = self.wrapper(self.session.delete)
 
+    def use_adapter(self, adapter):
+        self.session.mount('http+unix://', adapter)
+
     def wrapper(self, func):
         @wraps(func)
         def wrapper(path, *args, **kwargs):
@@ -107,32 +164,116 @@ class NspawnClient(object):
     def remove(self, machine):
         self.session.delete('/remove', data=dict(machine=machine))
 
-    def drop(self, machine):
-        self.session.post('/stop', data=dict(machine=machine))
-        time.sleep(5)
-        self.session.delete('/remove', data=dict(machine=machine))
+    def terminate(self, machine):
+        """
+        Force the machine down from the inside, the machine API has no
+        terminate call.
+        """
+        try:
+            self.run(machine, 'poweroff -f')
+        except Exception as exc:
+            # the machine may go away before answering
+            logger.debug('poweroff -f in %s: %s', machine, exc)
+
+    def drop(self, machine, deadline=STOP_DEADLINE):
+        """
+        Stop the machine and remove it as soon as it is down. A machine
+        still up after `deadline` seconds is powered off. The removal is
+        attempted whatever happened before.
+        """
+        try:
+            self.session.post('/stop', data=dict(machine=machine))
+            if not self.wait_state(machine, STOPPED, deadline=deadline):
+                logger.warning(
+                    '%s did not stop in %ss, powering it off', machine, deadline)
+                self.terminate(machine)
+                self.wait_state(machine, STOPPED, deadline=deadline)
+        finally:
+            self.session.delete('/remove', data=dict(machine=machine))
+
+    def force_remove(self, machine):
+        """
+        Power the machine off and remove it, without waiting for a stop.
+        """
+        try:
+            self.terminate(machine)
+        finally:
+            self.session.delete('/remove', data=dict(machine=machine))
 
     def configure_salt(self, config):
-        root = config['salt_config']['root']
-        for item in root.listdir():
-            config['client'].copy_to(
-                config['name'],
-                item.strpath,
-                item.strpath.replace(root.strpath, '/etc/salt'))
+        conf_path = pack_salt_config(config)
+        target = '/tmp/{0}'.format(conf_path.basename)
+        self.copy_to(config['name'], conf_path.strpath, target)
+        self.run(
+            config['name'],
+            'sh -c "tar -xf {0} -C /etc/salt && rm -f {0}"'.format(target))
+
+    def put_archive(self, machine, path, data):
+        """
+        Extract the tar `data` at `path` in the machine, the same way as
+        `configure_salt` (the machine API only copies host files).
+        """
+        with tempfile.NamedTemporaryFile(suffix='.tar') as f:
+            f.write(data)
+            f.flush()
+            target = '/tmp/{0}'.format(os.path.basename(f.name))
+            self.copy_to(machine, f.name, target)
+            self.run(
+                machine,
+                'sh -c "tar -xf {0} -C {1} && rm -f {0}"'.format(target, path))
 
     def copy_to(self, machine, source, target):
         return self.session.post(
             '/copy-to',
             data=dict(machine=machine, source=source, target=target))
 
-    def getip(self, machine):
-        data = self.session.post(
+    def inspect(self, machine):
+        return self.session.post(
             '/inspect', data=dict(machine=machine, interface='host0')).json()
-        return data['NetworkSettings']['IPAddress']
+
+    def getip(self, machine):
+        return self.inspect(machine)['NetworkSettings']['IPAddress']
+
+    def state(self, machine):
+        """
+        'running', 'stopped' (or any other state the API reports) and
+        'gone' once the machine API does not know `machine` anymore.
+        """
+        try:
+            data = self.inspect(machine)
+        except requests.HTTPError as exc:
+            if exc.response is not None and exc.response.status_code == 404:
+                return 'gone'
+            raise
+        return data.get('State', dict()).get('Status')
+
+    def wait_state(self, machine, states, deadline=None, policy=None):
+        """
+        Poll the machine state until it is one of `states`. Returns the
+        state, or None once `deadline` seconds have passed.
+        """
+        def reached():
+            state = self.state(machine)
+            return state if state in states else None
+        return wait_for(
+            reached, deadline=deadline, policy=policy, name='nspawn_wait_state')
 
     def create_host_config(self, **kwargs):
         return kwargs
 
+    def networks(self, names=None):
+        # machines share the host network, there is nothing to create
+        return [dict(Name=it) for it in names or []]
+
+    def create_network(self, **kwargs):
+        pass
+
+    def create_endpoint_config(self, **kwargs):
+        return kwargs
+
+    def create_networking_config(self, endpoints):
+        return dict(EndpointsConfig=endpoints)
+
     def run(self, name, command, stream=False):
         resp = self.session.post(
             '/run',
@@ -142,3 +283,29 @@ class NspawnClient(object):
             return resp.json()['stdoutdata']
         else:
             return resp.iter_lines()
+
+    def execute(self, name, command):
+        """
+        Run `command` and return its ExecResult. The machine API does not
+        report exit codes, the command prints its own after its output.
+        """
+        start_time = time.time()
+        data = self.session.post(
+            '/run',
+            data=dict(
+                machine=name,
+                command='sh -c {0}'.format(shlex_quote(
+                    "{0}; printf '\\n__sc_exit_%d__\\n' $?".format(command))),
+                stream=False)).json()
+        stdout = data['stdoutdata']
+        if not isinstance(stdout, bytes):
+            stdout = stdout.encode('utf8')
+        stderr = data.get('stderrdata') or b''
+        if not isinstance(stderr, bytes):
+            stderr = stderr.encode('utf8')
+        match = EXIT_MARKER.search(stdout)
+        return ExecResult(
+            exit_code=int(match.group(1)) if match else None,
+            stdout=stdout[:match.start()] if match else stdout,
+            stderr=stderr,
+            duration=time.time() - start_time)
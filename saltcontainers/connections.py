@@ -0,0 +1,170 @@
+import socket
+import logging
+import threading
+import requests.adapters
+from six.moves.urllib.parse import unquote
+
+try:
+    from requests.packages import urllib3
+except ImportError:
+    import urllib3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class PoolStats(object):
+    """
+    Connection pool counters shared by every client of the session.
+
+    `requests` sent, `connections` opened, `reuses` of a kept-alive
+    connection, `waits` for a free connection (blocking pools) and
+    connections `discarded` because the pool was full.
+    """
+
+    fields = ('requests', 'connections', 'reuses', 'waits', 'discarded')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict((it, 0) for it in self.fields)
+
+    def record(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def report(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict((it, 0) for it in self.fields)
+
+
+class UnixConnection(urllib3.connection.HTTPConnection, object):
+
+    def __init__(self, socket_path, timeout=60):
+        super(UnixConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+        self.socket_timeout = timeout
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.socket_timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class UnixConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    """
+    Keep-alive connections to one unix socket, whatever the URL path.
+    """
+
+    def __init__(self, socket_path, timeout=60, maxsize=1, block=False,
+                 stats=None):
+        super(UnixConnectionPool, self).__init__(
+            'localhost', timeout=timeout, maxsize=maxsize, block=block)
+        self.socket_path = socket_path
+        self.socket_timeout = timeout
+        self.stats = stats or PoolStats()
+
+    def _new_conn(self):
+        self.num_connections += 1
+        self.stats.record('connections')
+        return UnixConnection(self.socket_path, self.socket_timeout)
+
+    def _get_conn(self, timeout=None):
+        if self.block and self.pool is not None and self.pool.empty():
+            self.stats.record('waits')
+        opened = self.num_connections
+        conn = super(UnixConnectionPool, self)._get_conn(timeout=timeout)
+        if self.num_connections == opened:
+            self.stats.record('reuses')
+        return conn
+
+    def _put_conn(self, conn):
+        if self.pool is not None and self.pool.full():
+            self.stats.record('discarded')
+        return super(UnixConnectionPool, self)._put_conn(conn)
+
+
+class UnixAdapter(requests.adapters.HTTPAdapter):
+    """
+    Send every request of a session through one UnixConnectionPool.
+    """
+
+    def __init__(self, socket_path, timeout=60, maxsize=10, block=False,
+                 stats=None):
+        super(UnixAdapter, self).__init__()
+        self.stats = stats or PoolStats()
+        self.pool = UnixConnectionPool(
+            socket_path, timeout=timeout, maxsize=maxsize, block=block,
+            stats=self.stats)
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None,
+                                        cert=None):
+        return self.pool
+
+    def request_url(self, request, proxies):
+        return request.path_url
+
+    def send(self, request, **kwargs):
+        self.stats.record('requests')
+        return super(UnixAdapter, self).send(request, **kwargs)
+
+    def close(self):
+        self.pool.close()
+
+
+def socket_path(url):
+    """
+    '/var/run/docker.sock' out of 'unix://var/run/docker.sock' or
+    'http+unix://%2Fvar%2Frun%2Fgunicorn.sock'.
+    """
+    path = unquote(url.split('://', 1)[-1])
+    return path if path.startswith('/') else '/' + path
+
+
+class ConnectionRegistry(object):
+    """
+    One client per backend and URL for the whole session.
+
+    Clients are built on first use by `build(url)` and get an adapter with
+    a pool of `maxsize` keep-alive connections (waiting for a free one when
+    `block` is set) instead of a pool per URL path.
+    """
+
+    def __init__(self, maxsize=10, block=False, timeout=120):
+        self.maxsize = maxsize
+        self.block = block
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.clients = dict()
+        self.adapters = []
+        self.stats = PoolStats()
+
+    def get(self, backend, url, build):
+        with self.lock:
+            key = (backend, url)
+            if key not in self.clients:
+                adapter = UnixAdapter(
+                    socket_path(url), timeout=self.timeout,
+                    maxsize=self.maxsize, block=self.block, stats=self.stats)
+                client = build(url)
+                client.use_adapter(adapter)
+                self.adapters.append(adapter)
+                self.clients[key] = client
+            return self.clients[key]
+
+    def clear(self):
+        with self.lock:
+            adapters, self.adapters = self.adapters, []
+            self.clients = dict()
+        for adapter in adapters:
+            adapter.close()
+
+
+connections = ConnectionRegistry()
@@ -0,0 +1,158 @@
+import re
+import json
+import uuid
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError
+from .utils import TIME_LIMIT
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+# the events the fixtures wait for, others are only matched while awaited
+RETAINED = re.compile(r'^salt/(auth|minion/[^/]+/start)$')
+
+
+class EventListener(object):
+    """
+    Follow the event bus of a master with a single `salt-run state.event`.
+
+    Callers get a future for the first event matching a tag (and optionally
+    some data fields). `salt/auth` and `salt/minion/<id>/start` events seen
+    before the call are matched too, so the order in which callers subscribe
+    does not matter for them.
+    """
+
+    command = 'salt-run state.event pretty=False -l quiet'
+    # where a listener without an exec id (nspawn) records its pid
+    pidfile = '/var/run/saltcontainers-events-{0}.pid'
+
+    def __init__(self, container):
+        self.container = container
+        self.cmd_exec_id = None
+        self.marker = uuid.uuid4().hex
+        self.events = []
+        self.waiting = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        client = self.container['config']['client']
+        lines = not hasattr(client, 'exec_create')
+        if lines:
+            stream = self.container.run(
+                "sh -c 'echo $$ > {0}; exec {1}'".format(
+                    self.pidfile.format(self.marker), self.command),
+                stream=True)
+        else:
+            self.cmd_exec_id, stream = self.container.check_run(
+                self.command, stream=True)
+        self.thread = threading.Thread(
+            target=self.follow, args=(stream, lines))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Kill the event stream and resolve the pending waiters with None.
+        Only this listener is killed, other workers sharing the master keep
+        theirs.
+        """
+        if self.thread is None:
+            return
+        self.thread = None
+        try:
+            if self.cmd_exec_id is not None:
+                self.container.kill(self.cmd_exec_id)
+            else:
+                self.container.execute(
+                    "sh -c 'kill $(cat {0}); rm -f {0}'".format(
+                        self.pidfile.format(self.marker)))
+        except Exception as exc:
+            logger.error('Failed to stop the event stream: {0}'.format(exc))
+        self.close()
+
+    def follow(self, stream, lines=False):
+        buf = b''
+        try:
+            for chunk in stream or []:
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode('utf8')
+                buf += chunk + b'\n' if lines else chunk
+                while b'\n' in buf:
+                    line, buf = buf.split(b'\n', 1)
+                    self.dispatch(line)
+        except Exception as exc:
+            logger.error(exc)
+        finally:
+            if buf:
+                self.dispatch(buf)
+            self.close()
+
+    def dispatch(self, line):
+        event = self.parse(line)
+        if event is None:
+            return
+        with self.lock:
+            if RETAINED.match(event['tag']):
+                self.events.append(event)
+            waiting = []
+            for future, tag, match in self.waiting:
+                if self.matches(event, tag, match):
+                    future.set_result(event)
+                else:
+                    waiting.append((future, tag, match))
+            self.waiting = waiting
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            waiting, self.waiting = self.waiting, []
+        for future, _, _ in waiting:
+            future.set_result(None)
+
+    @staticmethod
+    def parse(line):
+        line = line.decode('utf8', 'replace').strip()
+        if '\t' not in line:
+            return None
+        tag, data = line.split('\t', 1)
+        try:
+            data = json.loads(data)
+        except ValueError:
+            logger.debug('Unable to parse event data: {0}'.format(data))
+            return None
+        return dict(tag=tag, data=data)
+
+    @staticmethod
+    def matches(event, tag, match):
+        if event['tag'] != tag:
+            return False
+        data = event['data'] if isinstance(event['data'], dict) else {}
+        return all(data.get(k) == v for k, v in match.items())
+
+    def expect(self, tag, **match):
+        """
+        Return a future resolved with the first event matching `tag` and the
+        `match` data fields, or with None once the event stream is closed.
+        """
+        future = Future()
+        with self.lock:
+            for event in self.events:
+                if self.matches(event, tag, match):
+                    future.set_result(event)
+                    return future
+            if self.closed:
+                future.set_result(None)
+                return future
+            self.waiting.append((future, tag, match))
+        return future
+
+    def wait(self, tag, timeout=TIME_LIMIT, **match):
+        future = self.expect(tag, **match)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            logger.warning('Timed out waiting for {0} {1}'.format(tag, match))
@@ -1,19 +1,60 @@
 import os
 import py
-import yaml
+import time
 import string
 import logging
 import factory
 import factory.fuzzy
-import six
 from .models import ContainerModel, MasterModel, MinionModel
 from .clients import DockerClient, NspawnClient
+from .events import EventListener
+from .pool import pool
+from .layers import layers
+from .renderer import renderer
+from .profiling import profiler
+from .agent import ExecAgent
+from .connections import connections
+from .readiness import readiness
+from .networks import networks
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+DOCKER_URL = 'unix://var/run/docker.sock'
+NSPAWN_URL = 'http+unix:///var/run/gunicorn.sock'
+
+
+def start_daemon(container, command):
+    """
+    Run the daemonizing `command` and fail with its output unless it exited
+    with 0. An unknown exit code (nspawn output without its exit marker) is
+    only logged, the readiness probes are there to tell.
+    """
+    result = container.execute(command)
+    assert result is not None, '{0}: `{1}` did not run in time'.format(
+        container['config']['name'], command)
+    if result.exit_code is None:
+        logger.warning('{0}: unknown exit code of `{1}`'.format(
+            container['config']['name'], command))
+        return result
+    assert result.exit_code == 0, '{0}: `{1}` exited with {2}: {3}'.format(
+        container['config']['name'], command, result.exit_code,
+        result.stderr)
+    return result
+
+
+def client_for(type):
+    if type == 'docker':
+        return connections.get(
+            type, os.environ.get('DOCKER_HOST', DOCKER_URL),
+            lambda url: DockerClient(base_url=url, timeout=120))
+    elif type == 'nspawn':
+        return connections.get(
+            type, os.environ.get('NSPAWN_HOST', NSPAWN_URL), NspawnClient)
+
+
 class BaseFactory(factory.Factory):
 
     class Meta:
@@ -31,51 +72,44 @@ class SaltConfigFactory(BaseFactory):
     config = {}
     pillar = {}
     sls = {}
+    files = factory.LazyFunction(dict)
     id = factory.fuzzy.FuzzyText(
         length=5, prefix='id_', chars=string.ascii_letters)
 
     @factory.post_generation
     def extra_configs(obj, create, extracted, **kwargs):
         if extracted:
-            config_path = obj['root'] / '{}.d'.format(obj['conf_type'])
-            config_path.ensure_dir()
+            config_path = '{}.d'.format(obj['conf_type'])
+            renderer.add_dir(obj, config_path)
             for name, config in extracted.items():
-                config_file = config_path / '{0}.conf'.format(name)
-                config_file.write(
-                    yaml.safe_dump(config, default_flow_style=False))
+                renderer.add_yaml(
+                    obj, '{0}/{1}.conf'.format(config_path, name), config)
 
     @factory.post_generation
     def post(obj, create, extracted, **kwargs):
-        config_path = obj['root'] / '{}.d'.format(obj['conf_type'])
-        config_path.ensure_dir()
-        config_file = obj['root'] / obj['conf_type']
+        config_path = '{}.d'.format(obj['conf_type'])
+        renderer.add_dir(obj, config_path)
         main_config = {
             'include': '{0}.d/*'.format(obj['conf_type'])
         }
         if obj['conf_type'] in ['minion', 'proxy']:
             main_config['id'] = obj['id']
 
-        config_file.write(
-            yaml.safe_dump(main_config, default_flow_style=False))
+        renderer.add_yaml(obj, obj['conf_type'], main_config)
 
-        config_path = obj['root'] / '{}.d'.format(obj['conf_type'])
         for name, config in obj['config'].items():
-            config_file = config_path / '{0}.conf'.format(name)
-            config_file.write(yaml.safe_dump(config, default_flow_style=False))
+            renderer.add_yaml(
+                obj, '{0}/{1}.conf'.format(config_path, name), config)
 
-        pillar_path = obj['root'].ensure_dir('pillar')
+        renderer.add_dir(obj, 'pillar')
         for name, content in obj['pillar'].items():
-            sls_file = pillar_path / '{0}.sls'.format(name)
-            sls_file.write(yaml.safe_dump(content, default_flow_style=False))
+            renderer.add_yaml(obj, 'pillar/{0}.sls'.format(name), content)
 
-        sls_path = obj['root'].ensure_dir('sls')
+        renderer.add_dir(obj, 'sls')
         for item in obj['sls']:
-            source = py.path.local(item)
-            sls_file = sls_path / '{0}'.format(source.basename)
-            if six.PY3:
-                sls_file.write_text(source.read(), 'utf8')
-            else:
-                sls_file.write_text(source.read().decode('utf8'), 'utf8')
+            renderer.add_file(
+                obj, 'sls/{0}'.format(py.path.local(item).basename),
+                renderer.read(item))
 
 
 class MasterSaltConfigFactory(SaltConfigFactory):
@@ -86,41 +120,37 @@ class MasterSaltConfigFactory(SaltConfigFactory):
     def apply_states(obj, create, extracted, **kwargs):
         if extracted:
             destination = 'masterless'
-            config_path = obj['root'] / 'minion.d'
-            config_path.ensure_dir()
-            (config_path / 'masterless.conf').write(
-                yaml.safe_dump(
-                    {
-                        'file_client': 'local',
-                        'file_roots': {
-                            'base': ["/etc/salt/{}".format(destination)]
-                        },
-                        'pillar_roots': {'base': ["/etc/salt/pillar"]}
+            renderer.add_dir(obj, 'minion.d')
+            renderer.add_yaml(
+                obj,
+                'minion.d/masterless.conf',
+                {
+                    'file_client': 'local',
+                    'file_roots': {
+                        'base': ["/etc/salt/{}".format(destination)]
                     },
-                    default_flow_style=False
-                )
+                    'pillar_roots': {'base': ["/etc/salt/pillar"]}
+                }
             )
-            sls_path = obj['root'].ensure_dir(destination)
+            renderer.add_dir(obj, destination)
             for item in extracted:
-                source = py.path.local(item)
-                sls_file = sls_path / '{0}'.format(source.basename)
-                if six.PY3:
-                    sls_file.write_text(source.read(), 'utf8')
-                else:
-                    sls_file.write_text(source.read().decode('utf8'), 'utf8')
+                renderer.add_file(
+                    obj,
+                    '{0}/{1}'.format(destination, py.path.local(item).basename),
+                    renderer.read(item))
 
 
 class SyndicSaltConfigFactory(MasterSaltConfigFactory):
 
+    # the minion id and syndic_master in the tree make every layer unique
+    layer_cache = False
+
     @factory.post_generation
     def syndic_id(obj, create, extracted, **kwargs):
-        config_path = obj['root'] / 'minion.d'
-        config_path.ensure_dir()
-        config_file = obj['root'] / 'minion'
+        renderer.add_dir(obj, 'minion.d')
         main_config = {'include': 'minion.d/*'}
         main_config['id'] = obj['id']
-        config_file.write(
-            yaml.safe_dump(main_config, default_flow_style=False))
+        renderer.add_yaml(obj, 'minion', main_config)
 
 
 class ContainerConfigFactory(BaseFactory):
@@ -137,10 +167,7 @@ class ContainerConfigFactory(BaseFactory):
 
     @factory.lazy_attribute
     def client(self):
-        if self.factory_parent.type == 'docker':
-            return DockerClient(base_url='unix://var/run/docker.sock', timeout=120)
-        elif self.factory_parent.type == 'nspawn':
-            return NspawnClient('http+unix:///var/run/gunicorn.sock')
+        return client_for(self.factory_parent.type)
 
     @factory.lazy_attribute
     def volumes(self):
@@ -169,11 +196,9 @@ class ContainerConfigFactory(BaseFactory):
 
     @factory.post_generation
     def networking_config(self, create, extracted, **kwargs):
-        if not self['client'].networks(names=[extracted['name']]):
-            self['client'].create_network(**extracted)
-
         self['networking_config'] = self['client'].create_networking_config({
-            extracted['name']: self['client'].create_endpoint_config()
+            extracted['name']: networks.endpoint_config(
+                self['client'], extracted['name'], extracted.get('driver'))
         })
 
 
@@ -194,41 +219,24 @@ class ContainerFactory(BaseFactory):
     def build(cls, **kwargs):
         obj = super(ContainerFactory, cls).build(**kwargs)
         assert obj['config']['image']
-        client = obj['config']['client']
-        client.create_container(
-            **{
-                k: obj['config'][k] for k in obj['config'].keys()
-                if k not in ['salt_config', 'client', 'ssh_config']
-            }
-        )
-        obj['config']['client'].start(obj['config'])
-        obj['ip'] = obj['config']['client'].getip(obj['config']['name'])
+        layers.lookup(obj)
+        start = time.time()
+        pooled = pool.checkout(obj)
+        if pooled:
+            profiler.record(
+                'pool_checkout', obj['config']['name'], time.time() - start)
+        else:
+            obj.create()
+            pool.fill(obj)
+
+        if ExecAgent.enabled:
+            obj.start_agent()
 
         if obj['ssh_config']:
-            keys = dict(
-                rsa='/etc/ssh/ssh_host_rsa_key',
-                dsa='/etc/ssh/ssh_host_dsa_key',
-                ecdsa='/etc/ssh/ssh_host_ecdsa_key',
-                ed_25519='/etc/ssh/ssh_host_ed25519_key')
-            for k, v in six.iteritems(keys):
-                if not obj.run('ls {0}'.format(v)):
-                    out = obj.run('ssh-keygen -t {0} -f {1} -q -N ""'.format(k, v))
-            obj.run('./tests/scripts/chpasswd.sh {}:{}'.format(
-                obj['ssh_config']['user'], obj['ssh_config']['password']))
-            obj.run('mkdir -p /run/sshd')  # required in ubuntu
-            obj.run(
-                '/usr/sbin/sshd -p {0} -o "PermitRootLogin yes" -o "PasswordAuthentication yes"'.format(
-                    obj['ssh_config'].get('port', 22)
-                )
-            )
+            obj.setup_ssh()
 
-        try:
-            resp = six.u(obj.run('salt-call --version')).decode()
-            message = "{0}: {1}".format(
-                obj['config']['salt_config']['conf_type'], resp.strip())
-            logger.info(message)
-        except TypeError:
-            pass
+        if not pooled:
+            obj.probe()
 
         return obj
 
@@ -246,8 +254,10 @@ class SaltFactory(BaseFactory):
     def build(cls, **kwargs):
         obj = super(SaltFactory, cls).build(**kwargs)
         client = obj['container']['config']['client']
+        name = obj['container']['config']['name']
 
-        client.configure_salt(obj['container']['config'])
+        with profiler.phase('configure_salt', name):
+            client.configure_salt(obj['container']['config'])
 
         if os.environ.get('FLAVOR') == 'devel' and os.environ.get('SALT_REPO'):
             out = obj['container'].run('pip install --force-reinstall --ignore-installed PyYAML -e {0}'.format(
@@ -255,10 +265,8 @@ class SaltFactory(BaseFactory):
             obj['container'].run('find {0} | grep pyc$ | xargs rm -f'.format(
                 os.environ.get('SALT_REPO_MOUNTPOINT', '/salt/src/salt-devel/')))
 
-        output = client.run(
-            obj['container']['config']['name'], obj['cmd']
-        )
-        assert 'executable file not found' not in six.u(output).decode()
+        with profiler.phase('daemon_start', name):
+            start_daemon(obj['container'], obj['cmd'])
         return obj
 
 
@@ -276,9 +284,21 @@ class MasterFactory(SaltFactory):
     @classmethod
     def build(cls, **kwargs):
         obj = super(MasterFactory, cls).build(**kwargs)
+        name = obj['container']['config']['name']
+        readiness.wait(obj, 'master')
+        obj['events'] = EventListener(obj['container'])
+        obj['events'].start()
+        # stopped with the container
+        obj['container']['events'] = obj['events']
         if obj['container']['config']['salt_config'].get('roster'):
-            obj.update_roster()
-        obj['container'].run("salt-call --local state.apply")
+            with profiler.phase('update_roster', name):
+                obj.update_roster()
+        layer = obj['container'].get('layer')
+        if not (layer and layer['cached']):
+            with profiler.phase('state.apply', name):
+                obj['container'].run("salt-call --local state.apply")
+            with profiler.phase('layer_commit', name):
+                layers.commit(obj['container'])
         return obj
 
 
@@ -292,10 +312,8 @@ class SyndicFactory(MasterFactory):
     @classmethod
     def build(cls, **kwargs):
         obj = super(SyndicFactory, cls).build(**kwargs)
-        cmd = 'salt-syndic -d -l debug'
-        client = obj['container']['config']['client']
-        output = client.run(obj['container']['config']['name'], cmd)
-        assert 'executable file not found' not in output
+        start_daemon(obj['container'], 'salt-syndic -d -l debug')
+        readiness.wait(obj, 'syndic')
         return obj
 
 
@@ -308,4 +326,6 @@ class MinionFactory(SaltFactory):
 
     @classmethod
     def build(cls, **kwargs):
-        return super(MinionFactory, cls).build(**kwargs)
+        obj = super(MinionFactory, cls).build(**kwargs)
+        readiness.wait(obj, 'minion')
+        return obj
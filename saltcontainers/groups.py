@@ -0,0 +1,114 @@
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .transfer import Payload
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+MemberResult = namedtuple('MemberResult', 'value error duration')
+
+
+class Group(object):
+    """
+    Run the same call on many members at once.
+
+    Calls go to at most `workers` members concurrently. `map` returns a
+    MemberResult per member id holding the value or the exception raised
+    along with the call duration, one failing member does not stop the
+    others. Members are called without retries so that their errors are
+    reported instead of stalling the group until the retry time limit.
+    """
+
+    def __init__(self, members, workers=8):
+        self.members = dict(members)
+        self.workers = workers
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __getitem__(self, key):
+        return self.members[key]
+
+    @classmethod
+    def from_items(cls, items, workers=8):
+        """
+        Group the members of a topology list (`setup` config items).
+        """
+        return cls([(it['id'], it['fixture']) for it in items], workers=workers)
+
+    def _call(self, func, member):
+        start_time = time.time()
+        try:
+            return MemberResult(func(member), None, time.time() - start_time)
+        except Exception as exc:
+            logger.error(exc)
+            return MemberResult(None, exc, time.time() - start_time)
+
+    def map(self, func):
+        if not self.members:
+            return dict()
+        workers = min(self.workers, len(self.members))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = dict(
+                (key, executor.submit(self._call, func, member))
+                for key, member in self.members.items())
+        return dict((key, future.result()) for key, future in futures.items())
+
+
+def failures(results):
+    """
+    The member ids of `results` that raised, with their exception.
+    """
+    return dict(
+        (key, it.error) for key, it in results.items() if it.error is not None)
+
+
+class ContainerGroup(Group):
+
+    @classmethod
+    def from_items(cls, items, workers=8):
+        return cls(
+            [(it['id'], it['fixture'].get('container', it['fixture']))
+             for it in items],
+            workers=workers)
+
+    def run(self, command):
+        return self.map(lambda container: container.run_once(command))
+
+    def sync_to(self, files):
+        """
+        Seed the same files into every container, hashing and archiving
+        them once.
+        """
+        payload = files if isinstance(files, Payload) else Payload(files)
+        return self.map(lambda container: container.sync_to(payload))
+
+
+class MinionGroup(Group):
+
+    @classmethod
+    def from_setup(cls, config, workers=8):
+        """
+        Group every minion of the `setup` fixture config, syndic ones
+        included.
+        """
+        def minions(items):
+            for item in items:
+                for minion in item.get('minions', []):
+                    yield minion
+                for minion in minions(item.get('syndics', [])):
+                    yield minion
+        return cls.from_items(minions(config['masters']), workers=workers)
+
+    def run(self, command):
+        return self.map(lambda minion: minion['container'].run_once(command))
+
+    def salt_call(self, salt_command, *args):
+        return self.map(
+            lambda minion: minion.salt_call_once(salt_command, *args))
@@ -0,0 +1,102 @@
+import re
+import json
+import codecs
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]"]', re.S)
+STRING = re.compile(r'["\\]')
+
+
+class JSONStream(object):
+    """
+    Incremental parser for a stream of concatenated JSON objects, which is
+    what `salt --output=json` prints (one object per minion, as the returns
+    come in).
+
+    Chunks are scanned for object boundaries as they are fed and every
+    complete object is decoded right away, so only the object being
+    received is kept in memory. Anything outside of an object (log noise)
+    is skipped.
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf8')('replace')
+        self.parts = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk):
+        """
+        Consume `chunk` (bytes or text), return the objects it completed.
+        """
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        docs = []
+        start = 0
+        pos = 0
+        if self.escape and chunk:
+            self.escape = False
+            pos = 1
+        while True:
+            if self.in_string:
+                match = STRING.search(chunk, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if match.group() == '\\':
+                    if pos == len(chunk):
+                        self.escape = True
+                        break
+                    pos += 1
+                else:
+                    self.in_string = False
+            elif self.depth == 0:
+                pos = chunk.find('{', pos)
+                if pos < 0:
+                    start = len(chunk)
+                    break
+                start = pos
+                pos += 1
+                self.depth = 1
+            else:
+                match = TOKEN.search(chunk, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                token = match.group()
+                if token[0] == '"':
+                    # a string running past the end of the chunk
+                    self.in_string = len(token) == 1
+                elif token in '{[':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        self.parts.append(chunk[start:pos])
+                        docs.append(json.loads(''.join(self.parts)))
+                        self.parts = []
+                        start = pos
+        if self.depth:
+            self.parts.append(chunk[start:])
+        return docs
+
+    def close(self):
+        if self.depth:
+            raise ValueError(
+                'Incomplete JSON document: {0}'.format(''.join(self.parts)[:200]))
+
+
+def iter_json(chunks):
+    """
+    Yield the JSON objects found in the `chunks` iterable.
+    """
+    stream = JSONStream()
+    for chunk in chunks:
+        for doc in stream.feed(chunk):
+            yield doc
+    stream.close()
@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import posixpath
+import threading
+from docker.errors import APIError
+from .renderer import renderer
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class LayerCache(object):
+    """
+    Reuse masters that went through `salt-call --local state.apply`.
+
+    The configured container is committed to a local image tagged with a
+    digest of the base image id and of the salt config tree. Later masters
+    with the same digest are created from that image and skip the states.
+    The master keys and pid files are left out of the image and put back
+    in the running master, every master created from the image generates
+    its own keys. Syndics are not cached, their tree is unique to each.
+    """
+
+    repository = 'saltcontainers-layer'
+    pki = '/etc/salt/pki'
+    pidfiles = '/var/run/salt*.pid'
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.known = set()
+
+    @staticmethod
+    def digest(obj):
+        salt_config = obj['config']['salt_config']
+        # the id, not the name: a pulled base image makes a new layer
+        image = obj['config']['client'].inspect_image(obj['config']['image'])
+        digest = hashlib.sha1()
+        digest.update(image['Id'].encode('utf8'))
+        digest.update(salt_config['conf_type'].encode('utf8'))
+        digest.update(renderer.digest(salt_config).encode('utf8'))
+        return digest.hexdigest()
+
+    def applies(self, obj):
+        salt_config = obj['config'].get('salt_config')
+        return (
+            self.enabled and salt_config and
+            salt_config['conf_type'] == 'master' and
+            salt_config.get('layer_cache', True) and
+            hasattr(obj['config']['client'], 'commit'))
+
+    def exists(self, client, image):
+        with self.lock:
+            if image in self.known:
+                return True
+        if client.images(name=image, quiet=True):
+            with self.lock:
+                self.known.add(image)
+            return True
+        return False
+
+    def lookup(self, obj):
+        """
+        Point `obj` to the cached image for its digest when there is one.
+        """
+        if not self.applies(obj):
+            return
+        try:
+            tag = self.digest(obj)
+        except APIError as err:
+            logger.warning('Not caching {0}: {1}'.format(
+                obj['config']['name'], err))
+            return
+        image = '{0}:{1}'.format(self.repository, tag)
+        cached = self.exists(obj['config']['client'], image)
+        obj['layer'] = dict(tag=tag, cached=cached)
+        if cached:
+            logger.info('Using cached layer {0}'.format(image))
+            obj['config']['image'] = image
+
+    def commit(self, obj):
+        layer = obj.get('layer')
+        if not layer or layer['cached']:
+            return
+        client = obj['config']['client']
+        name = obj['config']['name']
+        # the running master keeps its keys and pid files, the image goes
+        # without them
+        found = obj.execute("sh -c 'ls -d {0}'".format(self.pidfiles))
+        paths = [self.pki]
+        if found is not None and found.exit_code == 0:
+            paths.extend(found.stdout.decode('utf8').split())
+        saved = [
+            (path, client.get_archive(name, path)[0].read()) for path in paths]
+        try:
+            result = obj.execute('rm -rf {0}'.format(' '.join(paths)))
+            if result is None or result.exit_code != 0:
+                logger.warning('Not caching {0}: could not remove {1}'.format(
+                    name, ' '.join(paths)))
+                return
+            client.commit(name, repository=self.repository, tag=layer['tag'])
+        finally:
+            for path, data in saved:
+                client.put_archive(name, posixpath.dirname(path), data)
+        with self.lock:
+            self.known.add('{0}:{1}'.format(self.repository, layer['tag']))
+
+
+layers = LayerCache()
@@ -1,39 +1,142 @@
 import re
 import json
-import yaml
 import tarfile
 import logging
 import six
 import subprocess
-from .utils import retry, load_json
+from six.moves import shlex_quote
+from .utils import retry, load_json, wait_for, ExecResult
+from .renderer import renderer
+from .profiling import profiler, profiled
+from .reaper import reaper
+from .agent import ExecAgent
+from .jsonstream import iter_json
+from .transfer import Payload, sync_to
+from .networks import networks, static_ip
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+STEP = (
+    "( eval {command} ) </dev/null; "
+    "printf '\\n__sc_step_{id}_%d__\\n' $?; "
+    "printf '\\n__sc_step_{id}__\\n' >&2"
+)
+
+
 class ContainerModel(dict):
 
     def _get_container_pid(self, pid):
         container_pid = None
         if pid:
-            with open('/proc/{0}/status'.format(pid), 'rb') as _file:
-                contents = _file.read()
-                try:
-                    container_pid = re.search("NSpid.+{0}.+".format(pid), contents).group().split('\t')[-1]
-                except:
-                    logger.warning("Unable to obtain container pid from {0}".format(pid))
+            try:
+                with open('/proc/{0}/status'.format(pid), 'rb') as _file:
+                    contents = _file.read().decode('utf8', 'replace')
+                container_pid = re.search(
+                    "NSpid.+{0}.+".format(pid), contents).group().split('\t')[-1]
+            except (IOError, OSError, AttributeError):
+                logger.warning("Unable to obtain container pid from {0}".format(pid))
         return container_pid
 
     def kill(self, cmd_exec_id):
         pid = self['config']['client'].exec_inspect(cmd_exec_id).get('Pid', None)
         container_pid = self._get_container_pid(pid)
+        if container_pid is None:
+            logger.warning('No pid to kill for exec {0}'.format(cmd_exec_id))
+            return
         self.run('kill -9 {0}'.format(container_pid))
 
     @retry()
     def run(self, command, stream=False):
+        return self.run_once(command, stream=stream)
+
+    def run_once(self, command, stream=False):
+        """
+        Like `run` without retries, errors are raised at once.
+        """
+        agent = self.live_agent()
+        if agent and not stream:
+            return agent.run(command).stdout
         return self['config']['client'].run(
             self['config']['name'], command, stream=stream)
 
+    @retry()
+    def execute(self, command):
+        """
+        Run `command` and return its ExecResult.
+        """
+        agent = self.live_agent()
+        if agent:
+            return agent.run(command)
+        return self['config']['client'].execute(
+            self['config']['name'], command)
+
+    def run_many(self, commands):
+        """
+        Run `commands` one after the other in a single exec and return an
+        ExecResult per command. Every command runs whatever the status of
+        the previous ones, the durations are not tracked per command.
+        """
+        script = '; '.join(
+            STEP.format(command=shlex_quote(command), id=idx)
+            for idx, command in enumerate(commands))
+        result = self.execute('sh -c {0}'.format(shlex_quote(script)))
+        if result is None:
+            return None
+        out, err = result.stdout, result.stderr
+        results = []
+        for idx, _ in enumerate(commands):
+            out_marker = re.search(
+                '\n__sc_step_{0}_(\\d+)__\n'.format(idx).encode('utf8'), out)
+            err_marker = re.search(
+                '\n__sc_step_{0}__\n'.format(idx).encode('utf8'), err)
+            if not out_marker:
+                # the shell died before reaching this command
+                results.append(ExecResult(result.exit_code, out, err, None))
+                out = err = b''
+                continue
+            results.append(ExecResult(
+                exit_code=int(out_marker.group(1)),
+                stdout=out[:out_marker.start()],
+                stderr=err[:err_marker.start()] if err_marker else err,
+                duration=None))
+            out = out[out_marker.end():]
+            err = err[err_marker.end():] if err_marker else b''
+        return results
+
+    def sync_to(self, files):
+        """
+        Copy (source, target) pairs or a Payload into the container in one
+        archive, skipping the files it already has. Returns the targets sent.
+        """
+        if not isinstance(files, Payload):
+            files = Payload(files)
+        return sync_to(self, files)
+
+    def start_agent(self):
+        if ExecAgent.supported(self):
+            self['agent'] = ExecAgent(self)
+            self['agent'].start()
+
+    def live_agent(self):
+        """
+        The exec agent unless its stream is gone, commands then go through
+        the client again.
+        """
+        agent = self.get('agent')
+        if agent is not None and agent.closed:
+            logger.warning('{0}: exec agent closed, using the client'.format(
+                self['config']['name']))
+            self.pop('agent', None)
+            return None
+        return agent
+
+    def stop_agent(self):
+        agent = self.pop('agent', None)
+        if agent is not None:
+            agent.close()
+
     @retry()
     def check_run(self, command, stream=False):
         cmd_exec = self['config']['client'].exec_create(self['config']['name'], cmd=command, stderr=False)
@@ -65,19 +168,92 @@ class ContainerModel(dict):
         for item in self['config']['networking_config']['EndpointsConfig'].keys():
             self['config']['client'].disconnect_container_from_network(self['config']['name'], item)
 
+    def create(self):
+        client = self['config']['client']
+        name = self['config']['name']
+        with profiler.phase('create_container', name):
+            client.create_container(
+                **{
+                    k: self['config'][k] for k in self['config'].keys()
+                    if k not in ['salt_config', 'client', 'ssh_config']
+                }
+            )
+        with profiler.phase('start', name):
+            client.start(self['config'])
+        self['ip'] = static_ip(self['config'])
+        if not self['ip']:
+            with profiler.phase('getip', name):
+                self['ip'] = client.getip(name)
+
+    @profiled('probe')
+    def probe(self):
+        try:
+            resp = self.run('salt-call --version')
+            if isinstance(resp, bytes):
+                resp = resp.decode()
+            message = "{0}: {1}".format(
+                self['config']['salt_config']['conf_type'], resp.strip())
+            logger.info(message)
+        except TypeError:
+            pass
+
+    @profiled('ssh')
+    def setup_ssh(self):
+        keys = dict(
+            rsa='/etc/ssh/ssh_host_rsa_key',
+            dsa='/etc/ssh/ssh_host_dsa_key',
+            ecdsa='/etc/ssh/ssh_host_ecdsa_key',
+            ed_25519='/etc/ssh/ssh_host_ed25519_key')
+        steps = [
+            '[ -e {1} ] || ssh-keygen -t {0} -f {1} -q -N ""'.format(k, v)
+            for k, v in sorted(six.iteritems(keys))]
+        steps.append('./tests/scripts/chpasswd.sh {}:{}'.format(
+            self['ssh_config']['user'], self['ssh_config']['password']))
+        steps.append('mkdir -p /run/sshd')  # required in ubuntu
+        steps.append(
+            '/usr/sbin/sshd -p {0} -o "PermitRootLogin yes" -o "PasswordAuthentication yes"'.format(
+                self['ssh_config'].get('port', 22)
+            )
+        )
+        for step, result in zip(steps, self.run_many(steps) or []):
+            if result.exit_code:
+                logger.error('{0}: {1} failed ({2}): {3}'.format(
+                    self['config']['name'], step, result.exit_code,
+                    result.stderr.decode('utf8', 'replace')))
+
+    def discard(self):
+        self['config']['client'].force_remove(self['config']['name'])
+        networks.release(self['config'])
+
     def remove(self):
-        self['config']['client'].stop(self['config']['name'])
-        self['config']['client'].remove_container(
-            self['config']['name'], v=True)
+        if self.get('removed'):
+            return
+        self['removed'] = True
+        events = self.pop('events', None)
+        if events is not None:
+            events.stop()
+        self.stop_agent()
+        if self.get('pool') and self['pool'].release(self):
+            return
+        reaper.reap(self)
 
 
 class BaseModel(dict):
 
     def salt_call(self, salt_command, *args):
+        return self._salt_call(self['container'].run, salt_command, args)
+
+    def salt_call_once(self, salt_command, *args):
+        """
+        Like `salt_call` without retries, errors are raised at once.
+        """
+        return self._salt_call(self['container'].run_once, salt_command, args)
+
+    def _salt_call(self, run, salt_command, args):
         command = "salt-call {0} {1} --output=json -l quiet".format(
             salt_command, ' '.join(args)
         )
-        raw = self['container'].run(command)
+        raw = run(command)
         try:
             out = json.loads(raw or '{}')
         except ValueError:
@@ -87,6 +263,12 @@ class BaseModel(dict):
     def start(self):
         self['container'].run(self['cmd'])
 
+    def stream_json(self, command):
+        """
+        Run `command` and yield the JSON objects it prints as they come.
+        """
+        return iter_json(self['container'].run(command, stream=True))
+
 
 class MasterModel(BaseModel):
 
@@ -102,12 +284,50 @@ class MasterModel(BaseModel):
     def salt_key_accept(self, minion_id):
         return self.salt_key_raw('-a', minion_id, '-y')
 
+    def salt_key_wait_pending(self, minion_ids, deadline=None):
+        """
+        Wait until every id in `minion_ids` is in `minions_pre`.
+        Auth events are awaited first so the keys are listed only once when
+        they are already there.
+        """
+        if self.get('events'):
+            for minion_id in minion_ids:
+                self['events'].wait('salt/auth', id=minion_id)
+
+        def pending():
+            keys = self.salt_key()['minions_pre']
+            return all(it in keys for it in minion_ids)
+
+        return wait_for(pending, deadline=deadline, name='salt_key_wait_pending')
+
+    def salt_key_accept_many(self, minion_ids, deadline=None):
+        """
+        Accept the keys of `minion_ids` with one salt-key call once they are
+        all pending and return the ids that ended up accepted.
+        """
+        minion_ids = list(minion_ids)
+        self.salt_key_wait_pending(minion_ids, deadline=deadline)
+        self.salt_key_raw('-a', ','.join(minion_ids), '-y')
+        accepted = self.salt_key()['minions']
+        return set(it for it in minion_ids if it in accepted)
+
     def salt(self, minion_id, salt_command, *args):
         command = "salt {0} {1} --output=json -l quiet".format(
             minion_id, salt_command, ' '.join(args))
         data = self['container'].run(command)
         return load_json(data)
 
+    def salt_iter(self, target, salt_command, *args):
+        """
+        Like `salt` but yield (minion_id, return) pairs as the minions
+        reply, without holding the whole output in memory.
+        """
+        command = "salt {0} {1} {2} --output=json -l quiet".format(
+            target, salt_command, ' '.join(args))
+        for doc in self.stream_json(command):
+            for item in six.iteritems(doc):
+                yield item
+
     def salt_run(self, command, *args):
         docker_command = "salt-run {0} {1} --output=json -l quiet".format(
             command, ' '.join(args))
@@ -131,9 +351,10 @@ class MasterModel(BaseModel):
                 "user": item['ssh_config']['user'],
                 "password": item['ssh_config']['password']
             }
-        roster.write(yaml.safe_dump(content, default_flow_style=False))
+        renderer.add_yaml(self['container']['config']['salt_config'], 'roster', content)
+        roster.write_binary(renderer.dump(content))
 
-        self['container']['config']['client'].copy_to(self, roster.strpath, '/etc/salt/')
+        self['container'].sync_to([(roster.strpath, '/etc/salt/roster')])
 
 
 class MinionModel(BaseModel):
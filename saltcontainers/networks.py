@@ -0,0 +1,209 @@
+import os
+import socket
+import struct
+import logging
+import threading
+from docker.utils import create_ipam_config, create_ipam_pool
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+def worker_shard():
+    """
+    (offset, stride) of this xdist worker, so that workers sharing a
+    network never hand out the same address.
+    """
+    worker = os.environ.get('PYTEST_XDIST_WORKER', '')
+    count = int(os.environ.get('PYTEST_XDIST_WORKER_COUNT') or 1)
+    if worker.startswith('gw') and count > 1:
+        return int(worker[2:]) % count, count
+    return 0, 1
+
+
+class IPAllocator(object):
+    """
+    Hand out the host addresses of `subnet` ('10.213.0.0/16').
+
+    The first address is left to the gateway, addresses in `reserved` are
+    never handed out and only one address out of `stride`, starting at
+    `offset`, is used.
+    """
+
+    def __init__(self, subnet, reserved=(), offset=0, stride=1):
+        network, bits = subnet.split('/')
+        size = 1 << (32 - int(bits))
+        base = ip_to_int(network) & ~(size - 1) & 0xffffffff
+        self.first = base + 2 + offset
+        self.last = base + size - 2
+        self.stride = stride
+        self.lock = threading.Lock()
+        self.used = set(ip_to_int(it) for it in reserved)
+        self.next = self.first
+
+    def allocate(self):
+        with self.lock:
+            candidate = self.next
+            for _ in range(0, self.last - self.first + 1, self.stride):
+                if candidate > self.last:
+                    candidate = self.first
+                if candidate not in self.used:
+                    self.used.add(candidate)
+                    self.next = candidate + self.stride
+                    return int_to_ip(candidate)
+                candidate += self.stride
+        raise RuntimeError('No address left in the container network')
+
+    def release(self, ip):
+        with self.lock:
+            self.used.discard(ip_to_int(ip))
+
+
+class NetworkManager(object):
+    """
+    Container networks of the session.
+
+    Each network is looked up (and created when missing) once per client
+    instead of once per container. With `static_ips`, docker networks are
+    created on `subnet` (outside of docker's default pools). Containers
+    then get their address from an IPAllocator and are created with it, so
+    the IP is known without inspecting the container after start.
+    Addresses in use by containers already attached to the network are
+    skipped. Concurrent sessions sharing a network on one host should use
+    different network names.
+    """
+
+    def __init__(self, subnet='10.213.0.0/16', static_ips=False):
+        self.subnet = subnet
+        self.static_ips = static_ips
+        self.lock = threading.Lock()
+        self.allocators = dict()
+
+    @staticmethod
+    def subnet_of(network):
+        configs = (network.get('IPAM') or dict()).get('Config') or []
+        return configs[0].get('Subnet') if configs else None
+
+    @staticmethod
+    def reserved(client, network):
+        """
+        Addresses of the containers already attached to `network`.
+        """
+        details = client.inspect_network(network['Id'])
+        return [
+            it['IPv4Address'].split('/')[0]
+            for it in (details.get('Containers') or dict()).values()
+            if it.get('IPv4Address')]
+
+    def ensure(self, client, name, driver=None):
+        """
+        Make sure network `name` exists. Returns its IPAllocator, or None
+        when containers get their address from docker.
+
+        Docker only takes static addresses on networks with a user
+        configured subnet, so an existing network is only used for them
+        when it was created on `subnet`, which docker never picks by itself
+        (it is outside of its default address pools).
+        """
+        with self.lock:
+            key = (client, name)
+            if key in self.allocators:
+                return self.allocators[key]
+            static = self.static_ips and hasattr(client, 'inspect_network')
+            found = [
+                it for it in client.networks(names=[name])
+                if it['Name'] == name]
+            allocator = None
+            if not found:
+                client.create_network(
+                    name, driver=driver, ipam=self.ipam() if static else None)
+                if static:
+                    allocator = self.allocator()
+            elif static and self.subnet_of(found[0]) == self.subnet:
+                allocator = self.allocator(self.reserved(client, found[0]))
+            elif static:
+                logger.warning(
+                    'network %s is not on %s, containers get their address '
+                    'from docker', name, self.subnet)
+            self.allocators[key] = allocator
+            return allocator
+
+    def ipam(self):
+        return create_ipam_config(
+            pool_configs=[create_ipam_pool(subnet=self.subnet)])
+
+    def allocator(self, reserved=()):
+        offset, stride = worker_shard()
+        return IPAllocator(
+            self.subnet, reserved=reserved, offset=offset, stride=stride)
+
+    def endpoint_config(self, client, name, driver=None):
+        """
+        Endpoint config of a new container on network `name`, with a static
+        address when the network has an allocator.
+        """
+        allocator = self.ensure(client, name, driver=driver)
+        endpoint = client.create_endpoint_config()
+        if allocator is not None:
+            endpoint['IPAMConfig'] = dict(IPv4Address=allocator.allocate())
+        return endpoint
+
+    def renew(self, config):
+        """
+        Networking config for a copy of the container `config`, with static
+        addresses of its own.
+        """
+        networking_config = config.get('networking_config')
+        if not any(static_addresses(config)):
+            return networking_config
+        endpoints = dict()
+        for name, endpoint in networking_config['EndpointsConfig'].items():
+            endpoint = dict(endpoint)
+            if (endpoint.get('IPAMConfig') or dict()).get('IPv4Address'):
+                with self.lock:
+                    allocator = self.allocators[(config['client'], name)]
+                endpoint['IPAMConfig'] = dict(IPv4Address=allocator.allocate())
+            endpoints[name] = endpoint
+        return dict(networking_config, EndpointsConfig=endpoints)
+
+    def release(self, config):
+        """
+        Give back the static addresses of a removed container.
+        """
+        for name, endpoint in static_addresses(config):
+            with self.lock:
+                allocator = self.allocators.get((config['client'], name))
+            if allocator is not None:
+                allocator.release(endpoint)
+
+    def clear(self):
+        with self.lock:
+            self.allocators = dict()
+
+
+def static_addresses(config):
+    endpoints = (config.get('networking_config') or dict()).get(
+        'EndpointsConfig') or dict()
+    for name, endpoint in endpoints.items():
+        ip = (endpoint.get('IPAMConfig') or dict()).get('IPv4Address')
+        if ip:
+            yield name, ip
+
+
+def static_ip(config):
+    """
+    The static address a container was created with, if any.
+    """
+    for _, ip in static_addresses(config):
+        return ip
+
+
+networks = NetworkManager()
@@ -1,21 +1,98 @@
 # -*- coding: utf-8 -*-
 
 import os
+import py
+import sys
 import pytest
-import six
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from docker import Client
 from faker import Faker
-from .utils import retry
+from .utils import retry, TIME_LIMIT
+from .pool import pool
+from .layers import layers
+from .renderer import renderer
+from .profiling import profiler, profiled
+from .models import ContainerModel, MasterModel, MinionModel
+from .events import EventListener
+from .broker import TopologyBroker, fingerprint
+from .registry import TopologyRegistry, reset_topology
+from .reaper import reaper
+from .agent import ExecAgent
+from .groups import MinionGroup
+from .connections import connections
+from .readiness import readiness
+from .networks import networks, static_addresses
 from saltcontainers.factories import (
-    ContainerFactory, MasterFactory, SyndicFactory, MinionFactory
+    ContainerFactory, MasterFactory, SyndicFactory, MinionFactory, client_for
 )
 
+if sys.version_info >= (3, 5):
+    from .aio import AsyncMaster, AsyncMinion
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
 
 def pytest_addoption(parser):
     parser.addini('IMAGE', help='docker image')
     parser.addini(
         'BASE_IMAGE', help='minimal docker image used to start bare containers')
     parser.addini('MINION_IMAGE', help='minion docker image')
+    parser.addini(
+        'SETUP_WORKERS',
+        help='number of containers the setup fixture brings up concurrently')
+    parser.addini(
+        'POOL_SIZE',
+        help='number of idle containers kept ready per image and salt role')
+    parser.addini(
+        'LAYER_CACHE',
+        help='commit configured masters to local images and reuse them',
+        type='bool', default=False)
+    parser.addini(
+        'SALT_CONFIG_ON_DISK',
+        help='also write rendered salt config trees under salt_root',
+        type='bool', default=False)
+    parser.addini(
+        'RENDER_CACHE_MB',
+        help='size of the cache of rendered salt configs, in megabytes')
+    parser.addini(
+        'PROFILE_REPORT',
+        help='print the slowest setup phases and write them as JSON to this path')
+    parser.addini(
+        'SHARE_TOPOLOGY',
+        help='share identical module_config topologies between xdist workers',
+        type='bool', default=False)
+    parser.addini(
+        'REUSE_TOPOLOGY',
+        help='keep module_config topologies up for the session and reuse them',
+        type='bool', default=False)
+    parser.addini(
+        'EXEC_AGENT',
+        help='run container commands through one persistent shell per container',
+        type='bool', default=False)
+    parser.addini(
+        'READINESS_PROBES',
+        help='return salt daemons from the factories only once they are ready',
+        type='bool', default=False)
+    parser.addini(
+        'READINESS_DEADLINE',
+        help='seconds to wait for a salt daemon to be ready')
+    parser.addini(
+        'STATIC_IPS',
+        help='create containers with addresses allocated from NETWORK_SUBNET',
+        type='bool', default=False)
+    parser.addini(
+        'NETWORK_SUBNET',
+        help='subnet of the container network (default 10.213.0.0/16)')
+    parser.addini(
+        'CLIENT_POOL_SIZE',
+        help='keep-alive connections kept per docker/nspawn socket (default 10)')
+    parser.addini(
+        'CLIENT_POOL_BLOCK',
+        help='wait for a free connection instead of opening extra ones',
+        type='bool', default=False)
     parser.addini(
         'TAGS',
         help='assign tags for this configuration',
@@ -23,6 +100,45 @@ def pytest_addoption(parser):
     )
 
 
+def pytest_configure(config):
+    pool.size = int(config.getini('POOL_SIZE') or 0)
+    layers.enabled = config.getini('LAYER_CACHE')
+    renderer.keep_files = config.getini('SALT_CONFIG_ON_DISK')
+    ExecAgent.enabled = config.getini('EXEC_AGENT')
+    readiness.enabled = config.getini('READINESS_PROBES')
+    if config.getini('READINESS_DEADLINE'):
+        readiness.deadline = float(config.getini('READINESS_DEADLINE'))
+    networks.static_ips = config.getini('STATIC_IPS')
+    networks.subnet = config.getini('NETWORK_SUBNET') or networks.subnet
+    connections.maxsize = int(config.getini('CLIENT_POOL_SIZE') or 10)
+    connections.block = config.getini('CLIENT_POOL_BLOCK')
+    if config.getini('RENDER_CACHE_MB'):
+        renderer.cache.max_size = int(config.getini('RENDER_CACHE_MB')) * 1024 * 1024
+
+
+def pytest_sessionfinish(session):
+    pool.clear()
+    reaper.drain()
+    connections.clear()
+    networks.clear()
+
+
+def pytest_terminal_summary(terminalreporter):
+    if reaper.failures:
+        terminalreporter.section('salt containers teardown failures')
+        for name, exc in reaper.failures:
+            terminalreporter.write_line('{0}: {1}'.format(name, exc))
+
+    path = terminalreporter.config.getini('PROFILE_REPORT')
+    if not path or not profiler.records:
+        return
+    terminalreporter.section('salt containers setup profile')
+    for line in profiler.summary():
+        terminalreporter.write_line(line)
+    profiler.write(path)
+    terminalreporter.write_line('profile written to {0}'.format(path))
+
+
 @pytest.fixture(scope="session")
 def docker_client():
     client = Client(base_url='unix://var/run/docker.sock', timeout=120)
@@ -124,24 +240,29 @@ def minion(request, minion_container):
     return out
 
 
+if sys.version_info >= (3, 5):
+
+    @pytest.fixture(scope="module")
+    def async_master(master):
+        return AsyncMaster(master)
+
+    @pytest.fixture(scope="module")
+    def async_minion(minion):
+        return AsyncMinion(minion)
+
+
+@profiled('wait_cached', arg=1)
 def wait_cached(master, minion):
-    command = 'salt-run --out json -l quiet state.event tagmatch="salt/auth"'
-    cmd_exec_id, stream = master['container'].check_run(command, stream=True)
-    for item in stream:
-        if six.b(minion['id']) in item:
-            master['container'].kill(cmd_exec_id)
-            break
+    master['events'].wait('salt/auth', id=minion['id'])
     assert minion['id'] in master.salt_key(minion['id'])['minions_pre']
 
 
+@profiled('accept', arg=1)
 def accept(master, minion):
-    tag = "salt/minion/{0}/start".format(minion['id'])
-    cmd = 'salt-run state.event tagmatch="{0}" count=1'.format(tag)
-    stream = master['container'].run(cmd, stream=True)
+    started = master['events'].expect(
+        "salt/minion/{0}/start".format(minion['id']))
     master.salt_key_accept(minion['id'])
-    for item in stream:
-        if six.b(minion['id']) in item:
-            break
+    started.result(timeout=TIME_LIMIT)
     assert minion['id'] in master.salt_key(minion['id'])['minions']
 
 
@@ -193,6 +314,170 @@ def default_minion_args(request, salt_root, master_ip):
     )
 
 
+def timed(phase, Factory, **kwargs):
+    return profiled(phase, arg=None)(Factory)(**kwargs)
+
+
+@profiled('accept_many')
+def accept_many(master, minions):
+    """
+    Accept the keys of `minions` in one batch and wait for them to start.
+    """
+    ids = [it['id'] for it in minions]
+    started = [
+        master['events'].expect("salt/minion/{0}/start".format(it))
+        for it in ids
+    ]
+    accepted = master.salt_key_accept_many(ids)
+    for future in started:
+        future.result(timeout=TIME_LIMIT)
+    assert accepted == set(ids)
+
+
+def build_minion(request, salt_root, minion_item, master_future):
+    master = master_future.result()
+    minion_args = default_minion_args(
+        request, salt_root, master['container']['ip'])
+    minion_args.update(minion_item.get('config', {}))
+    return timed('setup_minion', MinionFactory, **minion_args)
+
+
+def build_master(request, salt_root, file_root, pillar_root, item,
+                 is_syndic=False, master_future=None):
+    master = master_future.result() if master_future else None
+    master_args = default_master_args(
+        request,
+        salt_root,
+        file_root,
+        pillar_root,
+        is_syndic,
+        master)
+    master_args.update(item.get('config', {}))
+    Factory = MasterFactory if not is_syndic else SyndicFactory
+    return timed('setup_master', Factory, **master_args)
+
+
+def schedule_master(executor, request, salt_root, file_root, pillar_root,
+                    item, is_syndic=False, parent=None):
+    """
+    Submit the build of a master and of everything below it.
+
+    Nodes are submitted parent first so a worker waiting on its parent
+    future never waits on a task that is still queued behind it.
+    """
+    node = dict(
+        item=item,
+        future=executor.submit(
+            build_master, request, salt_root, file_root, pillar_root, item,
+            is_syndic, parent['future'] if parent else None),
+        syndics=[],
+        minions=[])
+    for syndic_item in item.get('syndics', []):
+        node['syndics'].append(
+            schedule_master(
+                executor, request, salt_root, file_root, pillar_root,
+                syndic_item, is_syndic=True, parent=node))
+    for minion_item in item.get('minions', []):
+        node['minions'].append(
+            dict(
+                item=minion_item,
+                future=executor.submit(
+                    build_minion, request, salt_root, minion_item,
+                    node['future'])))
+    return node
+
+
+def iter_nodes(node):
+    yield node
+    for minion_node in node.get('minions', []):
+        yield minion_node
+    for syndic_node in node.get('syndics', []):
+        for item in iter_nodes(syndic_node):
+            yield item
+
+
+def collect(finalizer, nodes):
+    """
+    Wait for every scheduled build, register the finalizers of the
+    containers that came up and re-raise the first build failure.
+    """
+    error = None
+    for node in nodes:
+        for item in iter_nodes(node):
+            try:
+                obj = item['future'].result()
+            except Exception as exc:
+                error = error or exc
+                continue
+            finalizer(obj['container'].remove)
+    if error is not None:
+        raise error
+
+
+def accept_node(master, node):
+    children = [it['future'].result() for it in node['minions']]
+    children.extend(it['future'].result() for it in node['syndics'])
+    if children:
+        accept_many(master, children)
+
+
+def accept_nodes(executor, nodes):
+    futures = []
+    for node in nodes:
+        for item in iter_nodes(node):
+            if 'syndics' in item:
+                futures.append(
+                    executor.submit(
+                        accept_node, item['future'].result(), item))
+    for future in futures:
+        future.result()
+
+
+def topology_item(node):
+    obj = node['future'].result()
+    item = dict(id=obj['id'], fixture=obj)
+    if 'syndics' in node:
+        item['syndics'] = [topology_item(it) for it in node['syndics']]
+        item['minions'] = [topology_item(it) for it in node['minions']]
+    node['item'].update(item)
+    return item
+
+
+def setup_workers(request):
+    return int(request.config.getini('SETUP_WORKERS') or 8)
+
+
+def setup_topology(request, salt_root, file_root, pillar_root, items,
+                   is_syndic=False, master=None, finalizer=None):
+    """
+    Bring up every master in `items` along with its syndics and minions.
+
+    Containers are built concurrently on a bounded pool, a syndic is only
+    built once its master is up and the keys of every master are accepted
+    in one batch. Container removals go to `finalizer`, the request's
+    finalizers by default.
+    """
+    parent = None
+    if master is not None:
+        parent = dict(future=Future())
+        parent['future'].set_result(master)
+
+    with ThreadPoolExecutor(max_workers=setup_workers(request)) as executor:
+        nodes = [
+            schedule_master(
+                executor, request, salt_root, file_root, pillar_root, item,
+                is_syndic=is_syndic, parent=parent)
+            for item in items
+        ]
+        collect(finalizer or request.addfinalizer, nodes)
+        accept_nodes(executor, nodes)
+
+    if is_syndic:
+        accept_many(master, [node['future'].result() for node in nodes])
+
+    return [topology_item(node) for node in nodes]
+
+
 def setup_minion(request, salt_root, master, minion_item):
     sub_config_item = dict(id=None, fixture=None)
 
@@ -200,7 +485,7 @@ def setup_minion(request, salt_root, master, minion_item):
         request, salt_root, master['container']['ip'])
     minion_args.update(minion_item.get('config', {}))
 
-    minion = MinionFactory(**minion_args)
+    minion = timed('setup_minion', MinionFactory, **minion_args)
     request.addfinalizer(minion['container'].remove)
 
     sub_config_item['id'] = minion['id']
@@ -213,61 +498,206 @@ def setup_minion(request, salt_root, master, minion_item):
 
 
 def setup_master(request, salt_root, file_root, pillar_root, item, is_syndic=False, master=None):
-    config_item = dict(id=None, fixture=None, syndics=[], minions=[])
-
-    master_args = default_master_args(
-        request,
-        salt_root,
-        file_root,
-        pillar_root,
-        is_syndic,
-        master)
+    [config_item] = setup_topology(
+        request, salt_root, file_root, pillar_root, [item],
+        is_syndic=is_syndic, master=master)
+    return config_item
 
-    master_args.update(item.get('config', {}))
-    Factory = MasterFactory if not is_syndic else SyndicFactory
-    obj = Factory(**master_args)
-    request.addfinalizer(obj['container'].remove)
 
-    config_item['id'] = obj['id']
-    config_item['fixture'] = obj
+def dump_item(item):
+    container = item['fixture']['container']
+    data = dict(
+        id=item['id'],
+        cmd=item['fixture'].get('cmd'),
+        container=dump_container(container))
+    if 'syndics' in item:
+        data['syndics'] = [dump_item(it) for it in item['syndics']]
+        data['minions'] = [dump_item(it) for it in item['minions']]
+    return data
+
+
+def dump_container(container):
+    """
+    What the models of the other workers need of `container`: its static
+    addresses (released at teardown), salt config root and roster (update_roster,
+    salt_ssh).
+    """
+    salt_config = container['config']['salt_config']
+    return dict(
+        name=container['config']['name'],
+        ip=container['ip'],
+        type=container['type'],
+        image=container['config']['image'],
+        ssh_config=container.get('ssh_config'),
+        addresses=dict(static_addresses(container['config'])),
+        conf_type=salt_config['conf_type'],
+        root=salt_config['root'].strpath if salt_config.get('root') else None,
+        roster=[
+            dict(name=it['config']['name'], ip=it['ip'],
+                 ssh_config=it['ssh_config'])
+            for it in salt_config.get('roster') or []])
+
+
+def load_container(data):
+    salt_config = dict(
+        conf_type=data['conf_type'],
+        files=dict(),
+        root=py.path.local(data['root']) if data.get('root') else None,
+        roster=[
+            dict(config=dict(name=it['name']), ip=it['ip'],
+                 ssh_config=it['ssh_config'])
+            for it in data.get('roster') or []] or None)
+    return ContainerModel(
+        type=data['type'],
+        ip=data['ip'],
+        ssh_config=data.get('ssh_config'),
+        config=dict(
+            name=data['name'],
+            image=data['image'],
+            client=client_for(data['type']),
+            networking_config=dict(EndpointsConfig=dict(
+                (name, dict(IPAMConfig=dict(IPv4Address=ip)))
+                for name, ip in (data.get('addresses') or dict()).items())),
+            salt_config=salt_config))
+
+
+def load_item(data):
+    """
+    Rebuild the models of a topology built by another worker.
+    """
+    container = load_container(data['container'])
+    if 'syndics' not in data:
+        obj = MinionModel(id=data['id'], cmd=data['cmd'], container=container)
+        return dict(id=data['id'], fixture=obj)
+    obj = MasterModel(id=data['id'], cmd=data['cmd'], container=container)
+    obj['events'] = EventListener(container)
+    obj['events'].start()
+    return dict(
+        id=data['id'],
+        fixture=obj,
+        syndics=[load_item(it) for it in data['syndics']],
+        minions=[load_item(it) for it in data['minions']])
+
+
+def iter_items(items):
+    for item in items:
+        yield item
+        for sub_item in iter_items(item.get('syndics', []) + item.get('minions', [])):
+            yield sub_item
+
+
+def update_items(module_items, items):
+    for module_item, item in zip(module_items, items):
+        update_items(module_item.get('syndics', []), item.get('syndics', []))
+        update_items(module_item.get('minions', []), item.get('minions', []))
+        module_item.update(item)
+
+
+def teardown_topology(data):
+    for item in iter_items(data):
+        reaper.reap(load_container(item['container']))
+
+
+def share_topology(request):
+    return (
+        request.config.getini('SHARE_TOPOLOGY') and
+        os.environ.get('PYTEST_XDIST_WORKER'))
+
+
+def topology_key(request, module_config):
+    return fingerprint(
+        module_config['masters'],
+        request.config.getini('IMAGE'),
+        request.config.getini('MINION_IMAGE'))
+
+
+def shared_topology(request, tmpdir_factory, salt_root, file_root, pillar_root,
+                    module_config, finalizer=None):
+    """
+    Lease the topology of `module_config` from the workers' broker, building
+    it if no other worker did. The lease is released through `finalizer`,
+    the request's finalizers by default.
+    """
+    broker = TopologyBroker(
+        tmpdir_factory.getbasetemp().dirpath('topologies.json'))
+    key = topology_key(request, module_config)
+    built = []
+
+    def build():
+        removals = []
+        try:
+            built.extend(
+                setup_topology(
+                    request, salt_root, file_root, pillar_root,
+                    module_config['masters'], finalizer=removals.append))
+        except Exception:
+            for remove in removals:
+                remove()
+            raise
+        return [dump_item(it) for it in built]
+
+    data = broker.lease(key, build, os.environ['PYTEST_XDIST_WORKER'])
+    items = built
+    if not items:
+        items = [load_item(it) for it in data]
+        update_items(module_config['masters'], items)
+
+    def release():
+        for item in iter_items(items):
+            if item['fixture'].get('events'):
+                item['fixture']['events'].stop()
+        broker.release(key, teardown_topology)
+
+    (finalizer or request.addfinalizer)(release)
+    return items
+
+
+@pytest.fixture(scope='session')
+def topology_registry(request):
+    registry = TopologyRegistry()
+    request.addfinalizer(registry.teardown)
+    return registry
 
-    for syndic_item in item.get('syndics', []):
-        sub_config_item = setup_master(
-            request,
-            salt_root,
-            file_root,
-            pillar_root,
-            syndic_item,
-            is_syndic=True,
-            master=obj)
-        config_item['syndics'].append(sub_config_item)
-        syndic_item.update(sub_config_item)
 
-    for minion_item in item.get('minions', []):
-        sub_config_item = setup_minion(
-            request,
-            salt_root,
-            obj,
-            minion_item)
-        config_item['minions'].append(sub_config_item)
-        minion_item.update(sub_config_item)
+@pytest.fixture(scope='module')
+def topology_reset():
+    """
+    Called with the topology items when a module reuses a live topology.
+    """
+    return reset_topology
 
-    if is_syndic:
-        wait_cached(master, obj)
-        accept(master, obj)
 
-    return config_item
+def reused_topology(request, registry, reset, build, module_config):
+    """
+    Get the topology of `module_config` from the session registry.
+    """
+    key = topology_key(request, module_config)
+    topology = registry.get(key, build, reset=reset)
+    # the items were built for (and update) the module that first asked
+    items = [dict(it) for it in topology]
+    update_items(module_config['masters'], items)
+    return items
 
 
 @pytest.fixture(scope='module')
-def setup(request, module_config, salt_root, pillar_root, file_root):
-    config = dict(masters=[])
-    for item in module_config['masters']:
-        config_item = setup_master(
-            request, salt_root, file_root, pillar_root, item
-        )
-        config['masters'].append(config_item)
-        item.update(config_item)
+def setup(request, tmpdir_factory, topology_registry, topology_reset,
+          module_config, salt_root, pillar_root, file_root):
+    config = dict(masters=[], containers=[])
+
+    def build(finalizer=None):
+        if share_topology(request):
+            return shared_topology(
+                request, tmpdir_factory, salt_root, file_root, pillar_root,
+                module_config, finalizer=finalizer)
+        return setup_topology(
+            request, salt_root, file_root, pillar_root,
+            module_config['masters'], finalizer=finalizer)
+
+    if request.config.getini('REUSE_TOPOLOGY'):
+        config['masters'] = reused_topology(
+            request, topology_registry, topology_reset, build, module_config)
+    else:
+        config['masters'] = build()
 
     for item in module_config.get('containers', []):
         config_item = dict(id=None, fixture=None)
@@ -283,3 +713,9 @@ def setup(request, module_config, salt_root, pillar_root, file_root):
         config['containers'].append(config_item)
 
     return config, module_config
+
+
+@pytest.fixture(scope='module')
+def minion_group(request, setup):
+    config, _ = setup
+    return MinionGroup.from_setup(config, workers=setup_workers(request))
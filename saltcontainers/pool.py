@@ -0,0 +1,178 @@
+import json
+import string
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from factory.fuzzy import FuzzyText
+from .models import ContainerModel
+from .reaper import reaper
+from .networks import networks
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+# '[s]alt-' keeps pkill from matching the `sh -c` running it
+RESET_COMMAND = (
+    "sh -c \"pkill -9 -f '[s]alt-'; rm -rf "
+    '/etc/salt/pki /etc/salt/minion_id /var/cache/salt /var/run/salt* '
+    '/etc/salt/master /etc/salt/master.d /etc/salt/minion /etc/salt/minion.d '
+    '/etc/salt/proxy /etc/salt/proxy.d /etc/salt/pillar /etc/salt/sls '
+    '/etc/salt/masterless /etc/salt/roster"'
+)
+# config keys that are not passed to create_container or differ per container
+UNPOOLED_KEYS = ('salt_config', 'client', 'ssh_config', 'name', 'networking_config')
+
+
+class ContainerPool(object):
+    """
+    Keep `size` started containers per (type, image, conf_type, container
+    settings) ready to be checked out by `ContainerFactory`.
+
+    Idle containers are created in the background as soon as a key is first
+    used. Checked out containers are reset and recycled when released, or
+    removed if the reset fails.
+    """
+
+    def __init__(self, size=0, workers=4):
+        self.size = size
+        self.workers = workers
+        self.idle = dict()
+        self.leased = dict()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    @staticmethod
+    def key(obj):
+        salt_config = obj['config'].get('salt_config')
+        if obj.get('ssh_config') or not salt_config:
+            return None
+        return (
+            obj['type'], obj['config']['image'], salt_config['conf_type'],
+            ContainerPool.settings(obj['config']))
+
+    @staticmethod
+    def settings(config):
+        """
+        Digest of what `config` passes to create_container (volumes, binds,
+        environment, ports...) besides its name and addresses.
+        """
+        settings = dict(
+            (k, v) for k, v in config.items() if k not in UNPOOLED_KEYS)
+        settings['networks'] = sorted(
+            ((config.get('networking_config') or dict()).get(
+                'EndpointsConfig') or dict()).keys())
+        return hashlib.sha1(json.dumps(
+            settings, sort_keys=True, default=repr).encode('utf8')).hexdigest()
+
+    def _name(self, key):
+        return FuzzyText(
+            length=5, prefix='{0}_pool_'.format(key[2]),
+            chars=string.ascii_letters).fuzz()
+
+    def _create(self, template, key):
+        container = ContainerModel(
+            type=template['type'],
+            ip=None,
+            ssh_config=None,
+            config=dict(
+                template['config'], name=self._name(key),
+                networking_config=networks.renew(template['config'])))
+        container.create()
+        container.probe()
+        return container
+
+    def fill(self, template):
+        """
+        Schedule the creation of idle containers like `template` until there
+        are `size` of them (ready or being created).
+        """
+        key = self.key(template)
+        if not self.size or key is None:
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            idle = self.idle.setdefault(key, [])
+            while len(idle) < self.size:
+                idle.append(self.executor.submit(self._create, template, key))
+
+    def checkout(self, obj):
+        """
+        Hand a ready container over to `obj`. Returns False when the pool has
+        none for its key and the caller has to create one.
+        """
+        key = self.key(obj)
+        if not self.size or key is None:
+            return False
+        with self.lock:
+            idle = self.idle.get(key, [])
+            ready = [it for it in idle if it.done()]
+            future = (ready or idle or [None])[0]
+            if future is not None:
+                idle.remove(future)
+        if future is None:
+            return False
+        try:
+            container = future.result()
+        except Exception as exc:
+            logger.error(exc)
+            return False
+        networks.release(obj['config'])
+        obj['config']['name'] = container['config']['name']
+        obj['config']['networking_config'] = container['config'].get(
+            'networking_config')
+        obj['ip'] = container['ip']
+        obj['pool'] = self
+        with self.lock:
+            self.leased[obj['config']['name']] = (key, container)
+        self.fill(obj)
+        return True
+
+    def release(self, obj):
+        """
+        Take back a checked out container. Returns False if `obj` does not
+        come from the pool.
+        """
+        with self.lock:
+            key, container = self.leased.pop(obj['config']['name'], (None, None))
+        if container is None:
+            return False
+        try:
+            result = container.execute(RESET_COMMAND)
+        except Exception as exc:
+            logger.error(exc)
+            result = None
+        if result is None or result.exit_code != 0:
+            logger.error('Failed to reset {0}: {1}'.format(
+                container['config']['name'],
+                result.stderr if result is not None else 'no result'))
+            reaper.reap(container)
+            return True
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.size:
+                future = Future()
+                future.set_result(container)
+                idle.insert(0, future)
+                container = None
+        if container is not None:
+            reaper.reap(container)
+        return True
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, dict()
+            executor, self.executor = self.executor, None
+        for futures in idle.values():
+            for future in futures:
+                try:
+                    reaper.reap(future.result())
+                except Exception as exc:
+                    logger.error(exc)
+        if executor is not None:
+            executor.shutdown()
+
+
+pool = ContainerPool()
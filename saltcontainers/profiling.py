@@ -0,0 +1,112 @@
+import json
+import time
+import logging
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from .utils import retry_stats
+from .connections import connections
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Profiler(object):
+    """
+    Wall-clock timings of the setup phases of every container.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+
+    @contextmanager
+    def phase(self, name, container):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, container, time.time() - start)
+
+    def record(self, name, container, duration):
+        with self.lock:
+            self.records.append(
+                dict(phase=name, container=container, duration=duration))
+
+    def phases(self):
+        """
+        Aggregate the records per phase, slowest total first.
+        """
+        phases = dict()
+        with self.lock:
+            records = list(self.records)
+        for item in records:
+            phase = phases.setdefault(
+                item['phase'], dict(phase=item['phase'], count=0, total=0.0, max=0.0))
+            phase['count'] += 1
+            phase['total'] += item['duration']
+            phase['max'] = max(phase['max'], item['duration'])
+        return sorted(phases.values(), key=lambda it: -it['total'])
+
+    def report(self):
+        with self.lock:
+            records = list(self.records)
+        return dict(
+            phases=self.phases(),
+            records=records,
+            retries=retry_stats.report(),
+            connections=connections.stats.report())
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def summary(self, limit=10):
+        lines = ['{0:<30} {1:>6} {2:>10} {3:>10}'.format(
+            'phase', 'count', 'total(s)', 'max(s)')]
+        for item in self.phases()[:limit]:
+            lines.append('{phase:<30} {count:>6} {total:>10.2f} {max:>10.2f}'.format(**item))
+        retries = sorted(
+            retry_stats.report().items(), key=lambda it: -it[1]['slept'])
+        if retries:
+            lines.append('')
+            lines.append('{0:<50} {1:>8} {2:>10}'.format(
+                'retried call', 'attempts', 'slept(s)'))
+            for site, item in retries[:limit]:
+                lines.append('{0:<50} {1:>8} {2:>10.2f}'.format(
+                    site, item['attempts'], item['slept']))
+        stats = connections.stats.report()
+        if stats['requests']:
+            lines.append('')
+            lines.append('client connections: ' + ', '.join(
+                '{0}={1}'.format(it, stats[it]) for it in connections.stats.fields))
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.records = []
+
+
+profiler = Profiler()
+
+
+def container_name(obj):
+    container = obj.get('container', obj)
+    return container['config']['name']
+
+
+def profiled(name, arg=0):
+    """
+    Time a call as phase `name` of the container passed as argument `arg`,
+    or of the container it returns when `arg` is None.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            output = func(*args, **kwargs)
+            obj = output if arg is None else args[arg]
+            profiler.record(name, container_name(obj), time.time() - start)
+            return output
+        return wrapper
+    return decorator
@@ -0,0 +1,141 @@
+import socket
+import logging
+import binascii
+from .utils import wait_for, TIME_LIMIT
+from .profiling import profiler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+PUBLISH_PORT = 4505
+RET_PORT = 4506
+
+PIDFILES = dict(
+    master='/var/run/salt-master.pid',
+    minion='/var/run/salt-minion.pid',
+    syndic='/var/run/salt-syndic.pid')
+
+# in-container probes poll every POLL_INTERVAL for up to PROBE_WINDOW
+# seconds per exec
+POLL_INTERVAL = 0.1
+PROBE_WINDOW = 5
+
+
+def port_open(host, port, timeout=0.5):
+    """
+    Whether something accepts TCP connections on `host`:`port`.
+    """
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    except (socket.error, socket.timeout):
+        return False
+    sock.close()
+    return True
+
+
+def established(host, port):
+    """
+    Shell test for an established TCP connection to `host`:`port`, read from
+    /proc/net/tcp so the image needs no netstat. The kernel prints addresses
+    in host byte order, both orders are matched.
+    """
+    packed = socket.inet_aton(host)
+    addresses = sorted(set(
+        binascii.hexlify(it).decode('ascii').upper()
+        for it in (packed, packed[::-1])))
+    return 'grep -qE " ({0}):{1:04X} 01 " /proc/net/tcp'.format(
+        '|'.join(addresses), int(port))
+
+
+def salt_option(obj, key, default=None):
+    """
+    `key` as set in the salt config files of `obj`, `default` otherwise.
+    """
+    for config in obj['container']['config']['salt_config']['config'].values():
+        if isinstance(config, dict) and key in config:
+            return config[key]
+    return default
+
+
+class Readiness(object):
+    """
+    Wait for salt daemons to be up instead of returning right after `-d`.
+
+    Masters are ready once their publish and ret ports accept connections,
+    minions and syndics once their pid file exists and they hold a
+    connection to the ret port of their master. Ports are probed from the
+    host against the container ip. Pid files and connections are polled by
+    a shell loop inside the container, one exec per PROBE_WINDOW rather
+    than one per poll.
+    """
+
+    def __init__(self, enabled=False, deadline=None):
+        self.enabled = enabled
+        self.deadline = deadline
+
+    def ports(self, host, ports):
+        return wait_for(
+            lambda: all(port_open(host, it) for it in ports),
+            deadline=self.deadline, name='ready_ports')
+
+    def probe(self, obj, condition, name):
+        """
+        Wait until the shell `condition` holds in the container of `obj`.
+        """
+        deadline = TIME_LIMIT if self.deadline is None else self.deadline
+        polls = int(min(PROBE_WINDOW, deadline) / POLL_INTERVAL) or 1
+        command = (
+            "sh -c 'i=0; until {0}; do "
+            "[ $i -ge {1} ] && exit 1; i=$((i+1)); sleep {2}; done'").format(
+                condition, polls, POLL_INTERVAL)
+
+        def holds():
+            result = obj['container'].execute(command)
+            return result is not None and result.exit_code == 0
+
+        return wait_for(holds, deadline=self.deadline, name=name)
+
+    def pidfile(self, obj, daemon):
+        return self.probe(
+            obj, 'test -s {0}'.format(PIDFILES[daemon]), 'ready_pidfile')
+
+    def master(self, obj):
+        ports = [
+            salt_option(obj, 'publish_port', PUBLISH_PORT),
+            salt_option(obj, 'ret_port', RET_PORT)]
+        ready = self.ports(obj['container']['ip'], ports)
+        assert ready, '{0}: salt-master not listening on {1}'.format(
+            obj['id'], ports)
+
+    def connected(self, obj, daemon, master, port):
+        """
+        Wait for the pid file of `daemon`, then for its connection to the
+        ret port of `master`.
+        """
+        assert self.pidfile(obj, daemon), '{0}: salt-{1} not running'.format(
+            obj['id'], daemon)
+        if master:
+            assert self.probe(
+                obj, established(master, port), 'ready_connected'), (
+                    '{0}: salt-{1} not connected to {2}:{3}'.format(
+                        obj['id'], daemon, master, port))
+
+    def minion(self, obj):
+        self.connected(
+            obj, 'minion', salt_option(obj, 'master'),
+            salt_option(obj, 'master_port', RET_PORT))
+
+    def syndic(self, obj):
+        self.connected(
+            obj, 'syndic', salt_option(obj, 'syndic_master'),
+            salt_option(obj, 'syndic_master_port', RET_PORT))
+
+    def wait(self, obj, daemon):
+        if not self.enabled:
+            return
+        with profiler.phase('ready', obj['container']['config']['name']):
+            getattr(self, daemon)(obj)
+
+
+readiness = Readiness()
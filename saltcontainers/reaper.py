@@ -0,0 +1,58 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Reaper(object):
+    """
+    Remove containers in the background.
+
+    Containers are killed and removed right away (no graceful stop) on a
+    pool of `workers` threads, `drain` waits for all of them and returns the
+    ones that could not be removed.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = []
+        self.failures = []
+
+    def _discard(self, container):
+        container.discard()
+        return container
+
+    def reap(self, container):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            future = self.executor.submit(self._discard, container)
+            self.pending.append((container['config']['name'], future))
+        return future
+
+    def drain(self):
+        """
+        Wait for every queued removal. Returns (name, error) pairs, which are
+        also collected in `failures`.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+            executor, self.executor = self.executor, None
+        failures = []
+        for name, future in pending:
+            try:
+                future.result()
+            except Exception as exc:
+                logger.error('Failed to remove {0}: {1}'.format(name, exc))
+                failures.append((name, exc))
+        if executor is not None:
+            executor.shutdown()
+        self.failures.extend(failures)
+        return failures
+
+
+reaper = Reaper()
@@ -0,0 +1,67 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+MASTER_RESET = 'sh -c "rm -rf /var/cache/salt/master/jobs/*"'
+MINION_RESET = (
+    'sh -c "rm -f /etc/salt/grains; rm -rf /var/cache/salt/minion/proc/*; '
+    'salt-call saltutil.refresh_grains -l quiet"'
+)
+
+
+def reset_topology(items):
+    """
+    Clear what a test module usually leaves behind on a topology: the job
+    cache of masters and the custom grains and running jobs of minions.
+    """
+    for item in items:
+        obj = item['fixture']
+        if 'syndics' in item:
+            obj['container'].run(MASTER_RESET)
+            reset_topology(item['syndics'])
+            reset_topology(item['minions'])
+        else:
+            obj['container'].run(MINION_RESET)
+
+
+class TopologyRegistry(object):
+    """
+    Live topologies of the session, keyed by fingerprint.
+
+    A module asking for a fingerprint that is already up gets the same
+    topology after a reset, everything is torn down at session end.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.topologies = dict()
+        self.finalizers = []
+
+    def get(self, key, build, reset=reset_topology):
+        """
+        Return the topology stored under `key`, reset, or the one returned
+        by `build(finalizer)`. `build` registers its teardown steps through
+        `finalizer`.
+        """
+        with self.lock:
+            items = self.topologies.get(key)
+        if items is not None:
+            reset(items)
+            return items
+        items = build(self.finalizers.append)
+        with self.lock:
+            self.topologies[key] = items
+        return items
+
+    def teardown(self):
+        with self.lock:
+            finalizers, self.finalizers = self.finalizers, []
+            self.topologies = dict()
+        for finalizer in reversed(finalizers):
+            try:
+                finalizer()
+            except Exception as exc:
+                logger.error(exc)
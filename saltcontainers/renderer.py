@@ -0,0 +1,167 @@
+import io
+import py
+import six
+import yaml
+import hashlib
+import tarfile
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class LRUCache(object):
+    """
+    Byte strings kept up to `max_size` bytes, least recently used first out.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.items[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, item = self.items.popitem(last=False)
+                self.size -= len(item)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+class ConfigRenderer(object):
+    """
+    Render salt config trees in memory and pack them into tar streams.
+
+    The documents of a tree live in `salt_config['files']`, keyed by their
+    path relative to /etc/salt (None marks an empty directory). They are
+    only written under `salt_config['root']` when `keep_files` is set.
+
+    Rendered documents, sls sources (keyed by path and mtime) and finished
+    archives (keyed by the digest of the tree) are kept in an LRU cache, so
+    identical containers do not render or pack the same tree twice.
+    """
+
+    spool_size = 8 * 1024 * 1024
+
+    def __init__(self, keep_files=False, cache_size=64 * 1024 * 1024):
+        self.keep_files = keep_files
+        self.cache = LRUCache(cache_size)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1(repr(parts).encode('utf8')).hexdigest()
+
+    def dump(self, data):
+        key = self.key('yaml', data)
+        content = self.cache.get(key)
+        if content is None:
+            content = yaml.safe_dump(
+                data, default_flow_style=False).encode('utf8')
+            self.cache.set(key, content)
+        return content
+
+    def read(self, source):
+        source = py.path.local(source)
+        stat = source.stat()
+        key = self.key('source', source.strpath, stat.mtime, stat.size)
+        content = self.cache.get(key)
+        if content is None:
+            content = source.read_binary()
+            # sls files are utf8, fail early as writing them out used to
+            content.decode('utf8')
+            self.cache.set(key, content)
+        return content
+
+    @staticmethod
+    def digest(salt_config):
+        digest = hashlib.sha1()
+        for path in sorted(salt_config['files']):
+            digest.update(path.encode('utf8'))
+            digest.update(salt_config['files'][path] or b'/')
+        return digest.hexdigest()
+
+    def add_dir(self, salt_config, path):
+        salt_config['files'].setdefault(path, None)
+        if self.keep_files:
+            salt_config['root'].ensure_dir(path)
+
+    def add_file(self, salt_config, path, content):
+        if isinstance(content, six.text_type):
+            content = content.encode('utf8')
+        salt_config['files'][path] = content
+        if self.keep_files:
+            (salt_config['root'] / path).write_binary(content, ensure=True)
+
+    def add_yaml(self, salt_config, path, data):
+        self.add_file(salt_config, path, self.dump(data))
+
+    def write(self, salt_config, fileobj):
+        with tarfile.open(fileobj=fileobj, mode='w') as archive:
+            for path in sorted(salt_config['files']):
+                content = salt_config['files'][path]
+                info = tarfile.TarInfo('./{0}'.format(path))
+                if content is None:
+                    info.type = tarfile.DIRTYPE
+                    info.mode = 0o755
+                    archive.addfile(info)
+                else:
+                    info.size = len(content)
+                    info.mode = 0o644
+                    archive.addfile(info, io.BytesIO(content))
+        fileobj.seek(0)
+        return fileobj
+
+    def archive(self, salt_config):
+        """
+        Return the tree packed in a file object positioned at its start.
+
+        Archives up to `spool_size` are cached and returned as BytesIO, the
+        spooled file is only kept for larger trees: requests calls fileno()
+        on what it uploads, which would roll a spooled file over to disk.
+        """
+        key = self.key('archive', self.digest(salt_config))
+        content = self.cache.get(key)
+        if content is not None:
+            return io.BytesIO(content)
+        fileobj = self.write(
+            salt_config,
+            tempfile.SpooledTemporaryFile(max_size=self.spool_size))
+        fileobj.seek(0, io.SEEK_END)
+        if fileobj.tell() > self.spool_size:
+            fileobj.seek(0)
+            return fileobj
+        fileobj.seek(0)
+        content = fileobj.read()
+        fileobj.close()
+        self.cache.set(key, content)
+        return io.BytesIO(content)
+
+
+renderer = ConfigRenderer()
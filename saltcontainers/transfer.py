@@ -0,0 +1,102 @@
+import io
+import os
+import py
+import hashlib
+import logging
+import tarfile
+import threading
+from six.moves import shlex_quote
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def file_digest(path, block_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Payload(object):
+    """
+    Files to seed into containers, as (source, target) pairs.
+
+    Sources are hashed once. The archive of a given set of targets is built
+    once too and handed to every container missing exactly those files, so
+    identical fixtures cost a single tar whatever the number of containers.
+    """
+
+    def __init__(self, files=()):
+        self.lock = threading.Lock()
+        self.archives = dict()
+        self.files = dict()
+        for source, target in files:
+            self.add(source, target)
+
+    @classmethod
+    def from_dir(cls, source, target):
+        """
+        Every file under the `source` directory, mirrored under `target`.
+        """
+        source = py.path.local(source)
+        return cls(
+            (path.strpath, os.path.join(target, source.bestrelpath(path)))
+            for path in source.visit(lambda it: it.check(file=1)))
+
+    def add(self, source, target):
+        self.files[target] = (source, file_digest(source))
+        self.archives = dict()
+
+    def digests(self):
+        return dict((k, v[1]) for k, v in self.files.items())
+
+    def archive(self, targets):
+        """
+        Tar of `targets` with absolute target paths, to be extracted at /.
+        """
+        key = tuple(sorted(targets))
+        with self.lock:
+            if key not in self.archives:
+                data = io.BytesIO()
+                with tarfile.open(fileobj=data, mode='w') as archive:
+                    for target in key:
+                        archive.add(
+                            self.files[target][0], arcname=target.lstrip('/'))
+                self.archives[key] = data.getvalue()
+            return self.archives[key]
+
+
+def remote_digests(container, targets):
+    """
+    sha1 of the `targets` already present in `container`, in one exec.
+    """
+    if not targets:
+        return dict()
+    result = container.execute(
+        'sha1sum -- {0}'.format(
+            ' '.join(shlex_quote(it) for it in sorted(targets))))
+    digests = dict()
+    for line in (result.stdout if result else b'').decode('utf8', 'replace').splitlines():
+        parts = line.split(None, 1)
+        if len(parts) == 2:
+            digests[parts[1]] = parts[0]
+    return digests
+
+
+def sync_to(container, payload):
+    """
+    Send the files of `payload` that differ in `container` in one archive.
+    Returns the targets that were sent.
+    """
+    existing = remote_digests(container, payload.files)
+    changed = sorted(
+        target for target, digest in payload.digests().items()
+        if existing.get(target) != digest)
+    if changed:
+        container['config']['client'].put_archive(
+            container['config']['name'], '/', payload.archive(changed))
+    logger.debug('{0}: sent {1} of {2} files'.format(
+        container['config']['name'], len(changed), len(payload.files)))
+    return changed
@@ -1,7 +1,11 @@
 import time
 import json
+import struct
+import random
 import logging
+import threading
 from functools import wraps
+from collections import namedtuple
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -10,35 +14,169 @@ logger.setLevel(logging.INFO)
 TIME_LIMIT = 120
 
 
-def time_limit_reached(start_time):
-    if TIME_LIMIT < (time.time() - start_time):
-        return True
+ExecResult = namedtuple('ExecResult', 'exit_code stdout stderr duration')
 
 
-def retry(expected=None):
+class RetryPolicy(object):
+    """
+    How long to wait between attempts.
+
+    The first `fast_polls` attempts are spaced by `fast_interval`, then the
+    interval grows by `factor` up to `max_interval`, each sleep being spread
+    by +/- `jitter` (a fraction of the interval). Attempts stop once
+    `deadline` seconds have passed (TIME_LIMIT when not set), the last
+    sleep is cut short to end at the deadline.
+    """
+
+    def __init__(self, deadline=None, fast_polls=5, fast_interval=0.05,
+                 interval=0.1, factor=2, max_interval=2, jitter=0.1):
+        self.deadline = deadline
+        self.fast_polls = fast_polls
+        self.fast_interval = fast_interval
+        self.interval = interval
+        self.factor = factor
+        self.max_interval = max_interval
+        self.jitter = jitter
+
+    def delays(self):
+        for _ in range(self.fast_polls):
+            yield self.fast_interval
+        interval = self.interval
+        while True:
+            yield interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            interval = min(interval * self.factor, self.max_interval)
+
+    def remaining(self, start_time):
+        deadline = TIME_LIMIT if self.deadline is None else self.deadline
+        return deadline - (time.time() - start_time)
+
+    def expired(self, start_time):
+        return self.remaining(start_time) < 0
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+class RetryStats(object):
+    """
+    Attempts and time slept per retried call site.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sites = dict()
+
+    def record(self, site, attempts, slept, success):
+        with self.lock:
+            item = self.sites.setdefault(
+                site, dict(calls=0, attempts=0, slept=0.0, failures=0))
+            item['calls'] += 1
+            item['attempts'] += attempts
+            item['slept'] += slept
+            item['failures'] += 0 if success else 1
+
+    def report(self):
+        with self.lock:
+            return dict((k, dict(v)) for k, v in self.sites.items())
+
+    def reset(self):
+        with self.lock:
+            self.sites = dict()
+
+
+retry_stats = RetryStats()
+
+
+def call_site(func):
+    return '{0}.{1}'.format(
+        func.__module__, getattr(func, '__qualname__', func.__name__))
+
+
+def attempt(func, args, kwargs, until, policy, site):
+    policy = policy or DEFAULT_POLICY
+    delays = policy.delays()
+    success = False
+    output = None
+    attempts = 0
+    slept = 0.0
+    start_time = time.time()
+    while True:
+        logger.debug('retry: ' + site)
+        attempts += 1
+        try:
+            output = func(*args, **kwargs)
+            success = until(output)
+        except Exception as exc:
+            logger.error(exc)
+            success = False
+            output = None
+        remaining = policy.remaining(start_time)
+        if success or remaining <= 0:
+            break
+        # the last attempt happens at the deadline, not after it
+        delay = min(next(delays), remaining)
+        time.sleep(delay)
+        slept += delay
+    retry_stats.record(site, attempts, slept, success)
+    return output
+
+
+def retry(expected=None, until=None, policy=None):
+    """
+    Call the decorated function until it returns `expected` (anything when
+    not set) or until `until(output)` is true, following `policy`.
+    """
+    if until is None:
+        until = lambda output: (expected is None) or (output is expected)
+
     def decorator(func, *args, **kwargs):
+        site = call_site(func)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            success = False
-            output = None
-            start_time = time.time()
-            while not success and not time_limit_reached(start_time):
-                logger.debug('retry: ' + func.__name__)
-                try:
-                    output = func(*args, **kwargs)
-                    success = (expected is None) or (output is expected)
-                except Exception as exc:
-                    logger.error(exc)
-                    success = False
-                    output = None
-                if not success:
-                    time.sleep(1)
-            return output
+            return attempt(func, args, kwargs, until, policy, site)
 
         return wrapper
     return decorator
 
 
+def wait_for(predicate, deadline=None, policy=None, name=None):
+    """
+    Poll `predicate` until it returns something truthy and return it.
+    Returns the last (falsy) result once the deadline is reached.
+    """
+    if deadline is not None:
+        policy = RetryPolicy(**dict(vars(policy or DEFAULT_POLICY), deadline=deadline))
+    return attempt(
+        predicate, (), {}, bool, policy, name or call_site(predicate))
+
+
+def recv_exactly(sock, size):
+    read = getattr(sock, 'recv', None) or sock.read
+    data = b''
+    while len(data) < size:
+        chunk = read(size - len(data))
+        if not chunk:
+            raise EOFError('stream closed')
+        data += chunk
+    return data
+
+
+def iter_frames(sock):
+    """
+    Yield the (stream, data) frames of an attached docker exec socket (or
+    a file-like response body) until it is closed. Stream 1 is stdout and 2
+    is stderr.
+    """
+    while True:
+        try:
+            header = recv_exactly(sock, 8)
+        except EOFError:
+            return
+        stream, size = struct.unpack('>BxxxL', header)
+        yield stream, recv_exactly(sock, size)
+
+
 def load_json(data):
     try:
         return json.loads(data)
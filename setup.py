@@ -26,10 +26,12 @@ setup(
     install_requires=[
         'py',
         'pytest>=2.9.1',
+        # DockerClient.execute reads exec output through Client internals
         'docker-py==1.8.0',
         'factory-boy',
         'PyYAML',
-        'requests-unixsocket'
+        'requests-unixsocket',
+        'futures; python_version < "3.0"'
     ],
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -1,9 +1,13 @@
+import sys
 import pytest
 from mock import patch, MagicMock
+from saltcontainers.utils import ExecResult
 
 
 pytest_plugins = 'pytester'
 
+collect_ignore = ['test_aio.py'] if sys.version_info < (3, 5) else []
+
 
 @pytest.fixture
 def mocks(request, testdir):
@@ -16,7 +20,9 @@ def mocks(request, testdir):
         'saltcontainers.factories',
         DockerClient=MagicMock(**{
             'return_value.inspect_container.return_value': {
-                'NetworkSettings': {'IPAddress': 'fake-ip'}}
+                'NetworkSettings': {'IPAddress': 'fake-ip'}},
+            'return_value.getip.return_value': 'fake-ip',
+            'return_value.execute.return_value': ExecResult(0, b'', b'', 0)
         }))
     salt_key_mock = patch(
         'saltcontainers.factories.MasterModel.salt_key',
@@ -0,0 +1,494 @@
+"""
+Stand-ins for the docker engine API and the nspawn machine API on a unix
+socket.
+
+They answer the calls the factories make from memory with optional
+injected latency, and play just enough of salt-key for topologies to come
+up, so setup costs can be measured on machines without docker or nspawn::
+
+    with FakeEngine(latency=0.005) as engine:
+        os.environ['DOCKER_HOST'] = engine.url
+        ...
+        engine.stats()
+
+    with FakeNspawn() as machines:
+        os.environ['NSPAWN_HOST'] = machines.url
+        ...
+"""
+import io
+import os
+import re
+import json
+import time
+import shlex
+import struct
+import tarfile
+import tempfile
+import itertools
+import threading
+from collections import Counter
+import yaml
+from six.moves import socketserver
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.urllib.parse import urlparse, parse_qs
+
+
+DOCKER_ROUTES = [
+    ('POST', r'/containers/create$', 'create'),
+    ('POST', r'/containers/(?P<name>[^/]+)/start$', 'start'),
+    ('GET', r'/containers/(?P<name>[^/]+)/json$', 'inspect'),
+    ('POST', r'/containers/(?P<name>[^/]+)/exec$', 'exec_create'),
+    ('PUT', r'/containers/(?P<name>[^/]+)/archive$', 'put_archive'),
+    ('DELETE', r'/containers/(?P<name>[^/]+)$', 'remove'),
+    ('POST', r'/exec/(?P<id>[^/]+)/start$', 'exec_start'),
+    ('GET', r'/exec/(?P<id>[^/]+)/json$', 'exec_inspect'),
+    ('GET', r'/networks$', 'networks'),
+    ('POST', r'/networks/create$', 'create_network'),
+    ('GET', r'/networks/(?P<id>[^/]+)$', 'inspect_network'),
+    ('GET', r'/images/json$', 'images'),
+    ('POST', r'/commit$', 'commit'),
+]
+
+NSPAWN_ROUTES = [
+    ('POST', r'/clone$', 'clone'),
+    ('POST', r'/start$', 'start'),
+    ('POST', r'/bind$', 'bind'),
+    ('POST', r'/copy-to$', 'copy_to'),
+    ('POST', r'/inspect$', 'inspect'),
+    ('POST', r'/run$', 'run'),
+    ('POST', r'/stop$', 'stop'),
+    ('DELETE', r'/remove$', 'remove'),
+]
+
+EXIT_WRAPPER = re.compile(r"^(?P<command>.*); printf '\\n__sc_exit_%d__\\n' \$\?$", re.S)
+UNTAR = re.compile(r'^tar -xf (?P<archive>\S+) -C (?P<path>\S+)')
+
+
+def frame(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return 'fake-engine'
+
+    def log_message(self, *args):
+        pass
+
+    def handle_request(self):
+        engine = self.server.engine
+        url = urlparse(self.path)
+        path = re.sub(r'^/v[0-9.]+', '', url.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        for method, pattern, name in engine.routes:
+            match = re.match(pattern, path)
+            if method == self.command and match:
+                engine.dispatch(
+                    self, name, dict(parse_qs(url.query), **match.groupdict()), body)
+                return
+        engine.record('unknown')
+        self.reply(404, dict(message='no route for {0} {1}'.format(self.command, path)))
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+    def reply(self, status, data=None):
+        body = json.dumps(data).encode('utf8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, data):
+        # like the engine, hijack the connection and close it at exit
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+        self.close_connection = True
+
+    def chunked(self, chunks):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in chunks:
+            if chunk:
+                self.wfile.write(
+                    '{0:x}\r\n'.format(len(chunk)).encode('latin1') + chunk + b'\r\n')
+                self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeServer(object):
+    """
+    In-memory machines behind an API listening on `path` (a temporary
+    socket when not set). Every request sleeps `latency` seconds, or the
+    value given in `latencies` for its route.
+    """
+
+    routes = []
+    scheme = 'unix://'
+
+    def __init__(self, path=None, latency=0, latencies=None):
+        self.path = path or os.path.join(
+            tempfile.mkdtemp(prefix='fake-engine-'), 'engine.sock')
+        self.latency = latency
+        self.latencies = latencies or dict()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.hosts = itertools.count(2)
+        self.counts = Counter()
+        self.containers = dict()
+        self.server = None
+
+    @property
+    def url(self):
+        return self.scheme + self.path
+
+    def start(self):
+        self.server = Server(self.path, Handler)
+        self.server.engine = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def record(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        counts['total'] = sum(counts.values())
+        return counts
+
+    def reset(self):
+        with self.lock:
+            self.counts = Counter()
+
+    def parse(self, name, body):
+        return body
+
+    def dispatch(self, handler, name, params, body):
+        self.record(name)
+        time.sleep(self.latencies.get(name, self.latency))
+        getattr(self, 'do_' + name)(handler, params, self.parse(name, body))
+
+    def add_container(self, name, image):
+        with self.lock:
+            self.containers[name] = dict(
+                id='{0:064x}'.format(next(self.ids)), name=name, image=image,
+                running=False, files=dict(),
+                ip='172.30.{0}.{1}'.format(*divmod(next(self.hosts), 250)),
+                salt=dict(), keys=dict(pending=set(), accepted=set()))
+            return self.containers[name]
+
+    def container(self, handler, name):
+        with self.lock:
+            obj = self.containers.get(name)
+        if obj is None:
+            handler.reply(404, dict(message='No such container: ' + name))
+        return obj
+
+    def load_config(self, obj, data):
+        """
+        Pick the salt id and master out of a config archive.
+        """
+        with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+            for member in archive.getmembers():
+                if not member.isfile():
+                    continue
+                try:
+                    content = yaml.safe_load(archive.extractfile(member).read())
+                except yaml.YAMLError:
+                    continue
+                if isinstance(content, dict):
+                    obj['salt'].update(
+                        (k, v) for k, v in content.items() if k in ('id', 'master'))
+
+    def master_of(self, minion):
+        for obj in self.containers.values():
+            if obj['ip'] == minion['salt'].get('master'):
+                return obj
+
+    def execute(self, obj, cmd):
+        """
+        Play `cmd` in `obj`, returns (exit code, stdout, stderr).
+        """
+        with self.lock:
+            if cmd[:1] in (['salt-minion'], ['salt-syndic']) and obj['salt'].get('id'):
+                master = self.master_of(obj)
+                if master is not None:
+                    master['keys']['pending'].add(obj['salt']['id'])
+                return 0, b'', b''
+            if cmd[:1] == ['salt-key']:
+                keys = obj['keys']
+                if '-a' in cmd:
+                    ids = cmd[cmd.index('-a') + 1].split(',')
+                    for it in ids:
+                        if it in keys['pending']:
+                            keys['pending'].discard(it)
+                            keys['accepted'].add(it)
+                    return 0, b'', b''
+                return 0, json.dumps(dict(
+                    minions=sorted(keys['accepted']),
+                    minions_pre=sorted(keys['pending']),
+                    minions_rejected=[], minions_denied=[])).encode('utf8'), b''
+            if cmd[:2] == ['salt-call', '--version']:
+                return 0, b'salt-call 2016.11.4 (Carbon)\n', b''
+            if cmd[:1] == ['sha1sum']:
+                return 1, b'', b'sha1sum: No such file or directory\n'
+        return 0, b'', b''
+
+
+class FakeEngine(FakeServer):
+    """
+    The docker engine API: containers, exec, archives, networks and images.
+    """
+
+    routes = DOCKER_ROUTES
+
+    def __init__(self, *args, **kwargs):
+        super(FakeEngine, self).__init__(*args, **kwargs)
+        self.execs = dict()
+        self.networks = dict()
+        self.images = set()
+
+    def parse(self, name, body):
+        if body and name != 'put_archive':
+            return json.loads(body.decode('utf8'))
+        return body
+
+    def do_create(self, handler, params, data):
+        obj = self.add_container(params['name'][0], data.get('Image'))
+        endpoints = (data.get('NetworkingConfig') or dict()).get(
+            'EndpointsConfig') or dict()
+        for name, endpoint in endpoints.items():
+            ip = (endpoint.get('IPAMConfig') or dict()).get('IPv4Address')
+            if ip:
+                obj['ip'] = ip
+            with self.lock:
+                if name in self.networks:
+                    self.networks[name]['Containers'][obj['id']] = dict(
+                        Name=obj['name'], IPv4Address=obj['ip'] + '/16')
+        handler.reply(201, dict(Id=obj['id'], Warnings=None))
+
+    def do_start(self, handler, params, data):
+        obj = self.container(handler, params['name'])
+        if obj is not None:
+            obj['running'] = True
+            handler.reply(204)
+
+    def do_inspect(self, handler, params, data):
+        obj = self.container(handler, params['name'])
+        if obj is not None:
+            handler.reply(200, dict(
+                Id=obj['id'], Name='/' + obj['name'], Image=obj['image'],
+                State=dict(Running=obj['running']),
+                NetworkSettings=dict(
+                    IPAddress=obj['ip'],
+                    Networks=dict(network1=dict(IPAddress=obj['ip'])))))
+
+    def do_remove(self, handler, params, data):
+        with self.lock:
+            obj = self.containers.pop(params['name'], None)
+            for network in self.networks.values():
+                network['Containers'].pop(obj['id'] if obj else None, None)
+        handler.reply(204 if obj else 404)
+
+    def do_put_archive(self, handler, params, data):
+        obj = self.container(handler, params['name'])
+        if obj is not None:
+            self.load_config(obj, data)
+            handler.reply(200)
+
+    def do_exec_create(self, handler, params, data):
+        obj = self.container(handler, params['name'])
+        if obj is None:
+            return
+        exec_id = '{0:064x}'.format(next(self.ids))
+        cmd = data['Cmd']
+        if not isinstance(cmd, list):
+            cmd = shlex.split(cmd)
+        with self.lock:
+            self.execs[exec_id] = dict(
+                container=obj['name'], cmd=cmd, exit_code=None,
+                stdout=data.get('AttachStdout', True),
+                stderr=data.get('AttachStderr', True))
+        handler.reply(201, dict(Id=exec_id))
+
+    def do_exec_start(self, handler, params, data):
+        with self.lock:
+            item = self.execs.get(params['id'])
+        if item is None:
+            return handler.reply(404, dict(message='No such exec instance'))
+        code, out, err = self.execute(self.containers[item['container']], item['cmd'])
+        item['exit_code'] = code
+        handler.stream(
+            (frame(1, out) if out and item['stdout'] else b'') +
+            (frame(2, err) if err and item['stderr'] else b''))
+
+    def do_exec_inspect(self, handler, params, data):
+        with self.lock:
+            item = self.execs.get(params['id'])
+        if item is None:
+            return handler.reply(404, dict(message='No such exec instance'))
+        handler.reply(200, dict(
+            ID=params['id'], Running=False, Pid=0, ExitCode=item['exit_code']))
+
+    def do_networks(self, handler, params, data):
+        filters = json.loads(params.get('filters', ['{}'])[0])
+        names = filters.get('name', [])
+        with self.lock:
+            found = [
+                dict((k, v) for k, v in it.items() if k != 'Containers')
+                for name, it in sorted(self.networks.items())
+                if not names or any(n in name for n in names)]
+        handler.reply(200, found)
+
+    def do_create_network(self, handler, params, data):
+        with self.lock:
+            self.networks[data['Name']] = dict(
+                Id=data['Name'], Name=data['Name'], Driver=data.get('Driver'),
+                IPAM=data.get('IPAM') or dict(Driver='default', Config=[]),
+                Containers=dict())
+        handler.reply(201, dict(Id=data['Name']))
+
+    def do_inspect_network(self, handler, params, data):
+        with self.lock:
+            network = self.networks.get(params['id'])
+            network = json.loads(json.dumps(network))
+        if network is None:
+            return handler.reply(404, dict(message='network not found'))
+        handler.reply(200, network)
+
+    def do_images(self, handler, params, data):
+        name = params.get('filter', [None])[0]
+        with self.lock:
+            found = [dict(Id=it) for it in sorted(self.images)
+                     if name is None or it == name]
+        handler.reply(200, found)
+
+    def do_commit(self, handler, params, data):
+        image = '{0}:{1}'.format(params['repo'][0], params.get('tag', ['latest'])[0])
+        with self.lock:
+            self.images.add(image)
+        handler.reply(201, dict(Id=image))
+
+
+class FakeNspawn(FakeServer):
+    """
+    The machine API served by gunicorn on nspawn hosts. Files copied with
+    /copy-to are kept in memory and config archives extracted with tar are
+    read for the salt id and master.
+    """
+
+    routes = NSPAWN_ROUTES
+    scheme = 'http+unix://'
+
+    def __init__(self, *args, **kwargs):
+        # seconds a machine takes to shut down after /stop (None: never)
+        self.stop_delay = kwargs.pop('stop_delay', 0)
+        super(FakeNspawn, self).__init__(*args, **kwargs)
+
+    def status(self, obj):
+        if obj['running'] and obj.get('stopping') is not None:
+            if time.time() >= obj['stopping']:
+                obj['running'] = False
+        return 'running' if obj['running'] else 'stopped'
+
+    def parse(self, name, body):
+        return dict(
+            (k, v[0]) for k, v in parse_qs(body.decode('utf8')).items())
+
+    def do_clone(self, handler, params, data):
+        obj = self.add_container(data['target'], data['machine'])
+        handler.reply(200, dict(machine=obj['name']))
+
+    def do_start(self, handler, params, data):
+        obj = self.container(handler, data['machine'])
+        if obj is not None:
+            obj['running'], obj['stopping'] = True, None
+            handler.reply(200, dict(machine=obj['name']))
+
+    def do_bind(self, handler, params, data):
+        if self.container(handler, data['machine']) is not None:
+            handler.reply(200, dict(machine=data['machine']))
+
+    def do_copy_to(self, handler, params, data):
+        obj = self.container(handler, data['machine'])
+        if obj is not None:
+            with open(data['source'], 'rb') as f:
+                obj['files'][data['target']] = f.read()
+            handler.reply(200, dict(machine=obj['name']))
+
+    def do_inspect(self, handler, params, data):
+        obj = self.container(handler, data['machine'])
+        if obj is not None:
+            handler.reply(200, dict(
+                State=dict(Status=self.status(obj)),
+                NetworkSettings=dict(IPAddress=obj['ip'])))
+
+    def do_run(self, handler, params, data):
+        obj = self.container(handler, data['machine'])
+        if obj is None:
+            return
+        cmd = shlex.split(data['command'])
+        marker = False
+        if cmd[:2] == ['sh', '-c']:
+            wrapped = EXIT_WRAPPER.match(cmd[2])
+            if wrapped:
+                marker = True
+                cmd = shlex.split(wrapped.group('command'))
+        untar = UNTAR.match(cmd[2] if cmd[:2] == ['sh', '-c'] else '')
+        if untar and untar.group('archive') in obj['files']:
+            self.load_config(obj, obj['files'].pop(untar.group('archive')))
+            code, out, err = 0, b'', b''
+        elif cmd == ['poweroff', '-f']:
+            obj['running'] = False
+            code, out, err = 0, b'', b''
+        else:
+            code, out, err = self.execute(obj, cmd)
+        if marker:
+            out += "\n__sc_exit_{0}__\n".format(code).encode('utf8')
+        if data.get('stream') == 'True':
+            handler.chunked(out.splitlines(True))
+        else:
+            handler.reply(200, dict(
+                stdoutdata=out.decode('utf8'), stderrdata=err.decode('utf8')))
+
+    def do_stop(self, handler, params, data):
+        obj = self.container(handler, data['machine'])
+        if obj is not None:
+            if self.stop_delay is None:
+                obj['stopping'] = None
+            else:
+                obj['stopping'] = time.time() + self.stop_delay
+            self.status(obj)
+            handler.reply(200, dict(machine=obj['name']))
+
+    def do_remove(self, handler, params, data):
+        with self.lock:
+            obj = self.containers.pop(data['machine'], None)
+        handler.reply(200 if obj else 404, dict(machine=data['machine']))
@@ -0,0 +1,91 @@
+import re
+import time
+import socket
+import struct
+import threading
+from mock import MagicMock
+from saltcontainers.agent import ExecAgent
+from saltcontainers.models import ContainerModel
+
+
+def frame(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+def fake_shell(sock):
+    """
+    Answer every command line with 'out:<n>' on stdout, 'err:<n>' on stderr
+    and exit code n, n being the command id.
+    """
+    buf = b''
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            break
+        buf += data
+        while b'\n' in buf:
+            line, buf = buf.split(b'\n', 1)
+            if line == b'exit':
+                sock.close()
+                return
+            cmd_id = int(re.search(b'__sc_(\\d+)__', line).group(1))
+            # split markers across frames to exercise buffering
+            sock.sendall(frame(1, 'out:{0}\n__sc_{0}'.format(cmd_id).encode()))
+            sock.sendall(frame(2, 'err:{0}\n__sc_{0}__\n'.format(cmd_id).encode()))
+            sock.sendall(frame(1, '_{0}__\n'.format(cmd_id).encode()))
+
+
+def agent(timeout=None):
+    ours, theirs = socket.socketpair()
+    # docker-py leaves its client timeout on the hijacked socket
+    ours.settimeout(timeout)
+    thread = threading.Thread(target=fake_shell, args=(theirs,))
+    thread.daemon = True
+    thread.start()
+    client = MagicMock()
+    client.exec_create.return_value = {'Id': 'exec-id'}
+    client.exec_start.return_value = ours
+    container = ContainerModel(config=dict(name='container', client=client))
+    container.start_agent()
+    return container, client
+
+
+def test_agent_runs_commands_on_one_exec():
+    container, client = agent()
+
+    results = [container['agent'].submit('echo {0}'.format(i)) for i in range(3)]
+    results = [it.result(timeout=5) for it in results]
+
+    assert [it.stdout for it in results] == [b'out:0', b'out:1', b'out:2']
+    assert [it.stderr for it in results] == [b'err:0', b'err:1', b'err:2']
+    assert [it.exit_code for it in results] == [0, 1, 2]
+    assert container.run('true') == b'out:3'
+    assert client.exec_create.call_count == 1
+
+
+def test_agent_closed_on_remove():
+    container, client = agent()
+    agent_ = container['agent']
+
+    container.remove()
+
+    assert 'agent' not in container
+    assert agent_.closed
+    assert ExecAgent.supported(container)
+
+
+def test_agent_survives_idle_socket_timeout():
+    container, client = agent(timeout=0.2)
+    time.sleep(0.5)
+
+    assert not container['agent'].closed
+    assert container.run('true') == b'out:0'
+
+
+def test_closed_agent_falls_back_to_client():
+    container, client = agent()
+    client.run.return_value = b'from client'
+    container['agent'].close()
+
+    assert container.run_once('true') == b'from client'
+    assert 'agent' not in container
@@ -0,0 +1,109 @@
+import json
+import struct
+import asyncio
+from mock import MagicMock
+from saltcontainers.aio import (
+    AsyncContainer, AsyncDockerClient, AsyncMaster, async_client_for, demux)
+from saltcontainers.clients import DockerClient
+from saltcontainers.models import ContainerModel, MasterModel
+from saltcontainers.reaper import reaper
+
+
+def frame(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+class FakeEngine(object):
+    """
+    Docker engine answering exec requests with the command as JSON.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.execs = {}
+
+    async def handle(self, reader, writer):
+        method, url, _ = (await reader.readline()).decode().split()
+        length = 0
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            if line.lower().startswith('content-length'):
+                length = int(line.split(':')[1])
+        body = json.loads((await reader.readexactly(length)).decode() or 'null')
+        self.requests.append((method, url))
+        if url.endswith('/exec'):
+            exec_id = str(len(self.execs))
+            self.execs[exec_id] = body['Cmd']
+            payload = json.dumps({'Id': exec_id}).encode()
+            writer.write(
+                'HTTP/1.1 201 Created\r\nContent-Length: {0}\r\n\r\n'.format(
+                    len(payload)).encode() + payload)
+        else:
+            cmd = self.execs[url.split('/')[3]]
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: application/vnd.docker.raw-stream\r\n\r\n' +
+                frame(1, json.dumps({'cmd': cmd}).encode()) +
+                frame(2, b'noise'))
+        await writer.drain()
+        writer.close()
+
+
+def test_demux_keeps_stdout():
+    assert demux(frame(1, b'a') + frame(2, b'b') + frame(1, b'c')) == b'ac'
+
+
+def test_gather_salt_commands(tmpdir):
+    path = tmpdir.join('docker.sock').strpath
+    engine = FakeEngine()
+    container = ContainerModel(config=dict(name='master', client=MagicMock()))
+    master = AsyncMaster(MasterModel(container=container))
+    master.container.client = AsyncDockerClient('unix://' + path)
+
+    async def scenario():
+        server = await asyncio.start_unix_server(engine.handle, path=path)
+        try:
+            return await asyncio.gather(*[
+                master.salt('minion{0}'.format(i), 'test.ping')
+                for i in range(20)])
+        finally:
+            server.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+    assert [it['cmd'][1] for it in results] == [
+        'minion{0}'.format(i) for i in range(20)]
+    assert results[0]['cmd'][:3] == ['salt', 'minion0', 'test.ping']
+    assert len(engine.requests) == 40
+    assert ('POST', '/v1.22/containers/master/exec') in engine.requests
+
+
+def test_async_remove_goes_through_the_model():
+    events = MagicMock()
+    client = MagicMock()
+    container = ContainerModel(
+        config=dict(name='master', client=client), events=events)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(AsyncContainer(container, client).remove())
+    finally:
+        loop.close()
+    # the fixture finalizer
+    container.remove()
+    reaper.drain()
+
+    assert events.stop.call_count == 1
+    client.force_remove.assert_called_once_with('master')
+
+
+def test_async_client_follows_blocking_client():
+    client = async_client_for(DockerClient(base_url='unix://tmp/other.sock'))
+    assert client.transport.path == '/tmp/other.sock'
+    assert client.version == '1.22'
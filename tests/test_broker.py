@@ -0,0 +1,51 @@
+import pytest
+from saltcontainers.broker import TopologyBroker, fingerprint
+from saltcontainers.utils import RetryPolicy
+
+
+def test_fingerprint_is_canonical():
+    first = fingerprint({'masters': [{'minions': [{}, {}]}], 'a': 1}, 'image')
+    second = fingerprint({'a': 1, 'masters': [{'minions': [{}, {}]}]}, 'image')
+    assert first == second
+    assert first != fingerprint({'masters': [{'minions': [{}]}]}, 'image')
+
+
+def test_lease_builds_once_and_tears_down_last(tmpdir):
+    broker = TopologyBroker(tmpdir / 'topologies.json')
+    builds = []
+    teardowns = []
+
+    def build():
+        builds.append(1)
+        return [{'id': 'master'}]
+
+    assert broker.lease('key', build, 'gw0') == [{'id': 'master'}]
+    other = TopologyBroker(tmpdir / 'topologies.json')
+    assert other.lease('key', build, 'gw1') == [{'id': 'master'}]
+    assert len(builds) == 1
+
+    broker.release('key', teardowns.append)
+    assert not teardowns
+    other.release('key', teardowns.append)
+    assert teardowns == [[{'id': 'master'}]]
+
+
+def test_failed_build_is_forgotten(tmpdir):
+    broker = TopologyBroker(tmpdir / 'topologies.json')
+
+    def build():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        broker.lease('key', build, 'gw0')
+    assert broker.lease('key', lambda: [], 'gw1') == []
+
+
+def test_lease_waits_for_builder(tmpdir):
+    broker = TopologyBroker(
+        tmpdir / 'topologies.json',
+        policy=RetryPolicy(deadline=0.1, fast_interval=0.01))
+    with broker.state() as state:
+        state['key'] = dict(status='building', owner='gw0', refs=0)
+    with pytest.raises(RuntimeError):
+        broker.lease('key', lambda: [], 'gw1')
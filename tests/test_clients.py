@@ -0,0 +1,49 @@
+import io
+import struct
+import tarfile
+from mock import MagicMock
+from saltcontainers.clients import DockerClient, NspawnClient
+
+
+def salt_config(tmpdir):
+    files = {'master': b'include: master.d/*\n', 'master.d': None, 'pillar': None}
+    for name in ['a', 'b', 'c']:
+        files['master.d/{0}.conf'.format(name)] = b'{}\n'
+        files['pillar/{0}.sls'.format(name)] = b'{}\n'
+    return dict(
+        root=tmpdir.ensure_dir('master_abc'),
+        conf_path=tmpdir / 'master_abc.conf.tar',
+        files=files)
+
+
+def test_nspawn_configure_salt_single_upload(tmpdir):
+    client = NspawnClient('http://nspawn')
+    client.session.post = MagicMock()
+    config = dict(name='master_abc', salt_config=salt_config(tmpdir))
+
+    client.configure_salt(config)
+
+    [copy, run] = client.session.post.call_args_list
+    assert copy[0][0] == '/copy-to'
+    assert copy[1]['data']['source'] == config['salt_config']['conf_path'].strpath
+    assert run[0][0] == '/run'
+    assert 'tar -xf' in run[1]['data']['command']
+    with tarfile.open(config['salt_config']['conf_path'].strpath) as archive:
+        names = archive.getnames()
+    assert './master.d/c.conf' in names
+    assert './pillar/a.sls' in names
+
+
+def test_docker_execute_splits_streams():
+    client = DockerClient(base_url='unix://var/run/docker.sock')
+    client.exec_create = MagicMock(return_value={'Id': 'exec-id'})
+    client._post_json = MagicMock(return_value=MagicMock(raw=io.BytesIO(
+        struct.pack('>BxxxL', 1, 4) + b'out\n' +
+        struct.pack('>BxxxL', 2, 4) + b'err\n')))
+    client._raise_for_status = MagicMock()
+    client.exec_inspect = MagicMock(return_value={'ExitCode': 2})
+
+    result = client.execute('master_abc', 'false')
+
+    assert (result.exit_code, result.stdout, result.stderr) == (2, b'out\n', b'err\n')
+    assert client._post_json.call_args[0][0].endswith('/exec/exec-id/start')
@@ -0,0 +1,74 @@
+import json
+import threading
+from six.moves import socketserver
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from saltcontainers.clients import DockerClient, NspawnClient
+from saltcontainers.connections import ConnectionRegistry, socket_path
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return 'unix'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        body = json.dumps(dict(
+            path=self.path, stdoutdata='ok',
+            NetworkSettings=dict(IPAddress='10.0.0.2'))).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_DELETE = reply
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path):
+    server = Server(path, Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def test_socket_path():
+    assert socket_path('unix://var/run/docker.sock') == '/var/run/docker.sock'
+    assert socket_path(
+        'http+unix://%2Fvar%2Frun%2Fgunicorn.sock') == '/var/run/gunicorn.sock'
+
+
+def test_clients_share_keep_alive_connections(tmpdir):
+    path = tmpdir.join('engine.sock').strpath
+    server = serve(path)
+    registry = ConnectionRegistry(maxsize=2)
+    try:
+        nspawn = registry.get('nspawn', 'http+unix://' + path, NspawnClient)
+        docker = registry.get(
+            'docker', 'unix://' + path, lambda url: DockerClient(base_url=url))
+
+        assert registry.get('nspawn', 'http+unix://' + path, None) is nspawn
+        assert nspawn.run('machine', 'true') == 'ok'
+        assert nspawn.getip('machine') == '10.0.0.2'
+        nspawn.stop('machine')
+        assert docker.inspect_container('master')['path'] == (
+            '/v1.22/containers/master/json')
+
+        stats = registry.stats.report()
+        assert stats['requests'] == 4
+        assert stats['connections'] == 2
+        assert stats['reuses'] == 2
+    finally:
+        registry.clear()
+        server.shutdown()
+        server.server_close()
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import json
 import pytest
 
 
@@ -87,3 +88,165 @@ def test_minion(testdir):
     result = testdir.runpytest('-v')
 
     result.stdout.fnmatch_lines(['*::test_sth PASSED'])
+
+
+def test_setup(testdir):
+    testdir.makepyfile("""
+        import pytest
+
+
+        @pytest.fixture(scope="module")
+        def module_config():
+            return {
+                "masters": [
+                    {
+                        "minions": [{}, {}, {}],
+                        "syndics": [{"minions": [{}, {}]}]
+                    },
+                    {"minions": [{}]}
+                ]
+            }
+
+
+        def test_sth(setup):
+            config, initconfig = setup
+            [first, second] = config['masters']
+            assert len(first['minions']) == 3
+            assert len(second['minions']) == 1
+            [syndic] = first['syndics']
+            assert len(syndic['minions']) == 2
+            assert initconfig['masters'][0]['syndics'][0]['id'] == syndic['id']
+            for item in first['minions'] + syndic['minions']:
+                assert item['fixture']['id'] == item['id']
+    """)
+
+    result = testdir.runpytest('-v')
+
+    result.assert_outcomes(passed=1)
+    assert result.ret == 0
+
+
+def test_profile_report(testdir):
+    testdir.makeini("""
+        [pytest]
+        IMAGE = myregistry/defaultimage
+        PROFILE_REPORT = profile.json
+    """)
+    testdir.makepyfile("""
+        def test_sth(master, minion, minion_key_accepted):
+            pass
+    """)
+
+    result = testdir.runpytest('-v')
+
+    result.assert_outcomes(passed=1)
+    assert result.ret == 0
+    result.stdout.fnmatch_lines([
+        '*salt containers setup profile*',
+        'phase*count*total(s)*max(s)',
+        'profile written to profile.json'
+    ])
+    report = json.loads((testdir.tmpdir / 'profile.json').read())
+    phases = set(it['phase'] for it in report['phases'])
+    assert set(['create_container', 'configure_salt', 'daemon_start',
+                'state.apply', 'wait_cached', 'accept']) <= phases
+    assert 'retries' in report
+
+
+def test_setup_shared_between_workers(testdir, monkeypatch):
+    monkeypatch.setenv('PYTEST_XDIST_WORKER', 'gw0')
+    testdir.makeini("""
+        [pytest]
+        IMAGE = myregistry/defaultimage
+        SHARE_TOPOLOGY = true
+    """)
+    testdir.makepyfile("""
+        import json
+        import pytest
+
+
+        @pytest.fixture(scope="module")
+        def module_config():
+            return {"masters": [{"minions": [{}, {}]}]}
+
+
+        def test_sth(setup, tmpdir_factory):
+            config, initconfig = setup
+            [master] = config['masters']
+            assert len(master['minions']) == 2
+            state = tmpdir_factory.getbasetemp().dirpath('topologies.json')
+            [entry] = json.loads(state.read()).values()
+            assert entry['refs'] == 1
+            assert entry['topology'][0]['id'] == master['id']
+
+
+        def test_released_at_module_end(setup):
+            config, _ = setup
+            assert config['masters'][0]['fixture']['events']
+    """)
+
+    result = testdir.runpytest('-v')
+
+    result.assert_outcomes(passed=2)
+    assert result.ret == 0
+
+
+def test_setup_reused_across_modules(testdir):
+    testdir.makeini("""
+        [pytest]
+        IMAGE = myregistry/defaultimage
+        REUSE_TOPOLOGY = true
+    """)
+    module = """
+        import pytest
+
+
+        @pytest.fixture(scope="module")
+        def module_config():
+            return {{"masters": [{{"minions": [{{}}]}}]}}
+
+
+        def test_sth(setup, tmpdir_factory):
+            config, initconfig = setup
+            [master] = config['masters']
+            assert initconfig['masters'][0]['id'] == master['id']
+            names = tmpdir_factory.getbasetemp().join('names')
+            names.write(master['fixture']['container']['config']['name'] + '\\n', mode='a')
+            {check}
+    """
+    testdir.makepyfile(
+        test_a=module.format(check='pass'),
+        test_b=module.format(check="assert len(set(names.readlines())) == 1"))
+
+    result = testdir.runpytest('-v')
+
+    result.assert_outcomes(passed=2)
+    assert result.ret == 0
+
+
+def test_shared_containers_keep_what_other_workers_need(tmpdir):
+    from mock import MagicMock
+    from saltcontainers.models import ContainerModel
+    from saltcontainers.networks import static_ip
+    from saltcontainers.plugin import dump_container, load_container
+
+    target = ContainerModel(
+        ip='10.0.0.3', ssh_config=dict(user='root', password='admin123'),
+        config=dict(name='ssh_target'))
+    container = ContainerModel(
+        type='docker', ip='10.0.0.2', ssh_config=None,
+        config=dict(
+            name='master', image='image', client=MagicMock(),
+            networking_config=dict(EndpointsConfig=dict(
+                network1=dict(IPAMConfig=dict(IPv4Address='10.0.0.2')))),
+            salt_config=dict(
+                conf_type='master', root=tmpdir, roster=[target])))
+
+    loaded = load_container(json.loads(json.dumps(dump_container(container))))
+
+    assert static_ip(loaded['config']) == '10.0.0.2'
+    salt_config = loaded['config']['salt_config']
+    assert salt_config['root'] == tmpdir
+    [entry] = salt_config['roster']
+    assert entry['config']['name'] == 'ssh_target'
+    assert entry['ssh_config'] == target['ssh_config']
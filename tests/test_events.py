@@ -0,0 +1,83 @@
+import json
+from mock import MagicMock
+from saltcontainers.events import EventListener
+from saltcontainers.models import ContainerModel
+from saltcontainers.reaper import reaper
+
+
+def event(tag, data):
+    return '{0}\t{1}\n'.format(tag, json.dumps(data)).encode('utf8')
+
+
+def listener(*chunks):
+    container = MagicMock()
+    container.check_run.return_value = ('exec-id', iter(chunks))
+    obj = EventListener(container)
+    obj.start()
+    obj.thread.join()
+    return obj
+
+
+def test_events_split_across_chunks():
+    data = event('salt/auth', {'id': 'minion1', 'act': 'pend'})
+    obj = listener(data[:10], data[10:] + event('salt/minion/minion1/start', {}))
+    assert obj.wait('salt/auth', id='minion1')['data']['act'] == 'pend'
+    assert obj.expect('salt/minion/minion1/start').result(timeout=0)
+
+
+def test_events_matched_on_data():
+    obj = listener(
+        event('salt/auth', {'id': 'minion1'}),
+        event('salt/auth', {'id': 'minion2'}))
+    assert obj.wait('salt/auth', id='minion2')['data']['id'] == 'minion2'
+
+
+def test_closed_stream_resolves_pending():
+    obj = listener(b'garbage\n')
+    assert obj.expect('salt/auth', id='minion1').result(timeout=0) is None
+
+
+def test_only_awaited_events_are_kept():
+    obj = listener(
+        event('salt/auth', {'id': 'minion1'}),
+        event('salt/job/123/ret/minion1', {'return': True}),
+        event('salt/minion/minion1/start', {}))
+    assert [it['tag'] for it in obj.events] == [
+        'salt/auth', 'salt/minion/minion1/start']
+
+
+def test_stop_kills_the_event_stream_once():
+    obj = listener()
+    pending = obj.expect('salt/auth', id='minion1')
+    obj.stop()
+    obj.stop()
+    obj.container.kill.assert_called_once_with('exec-id')
+    assert not obj.container.execute.called
+    assert pending.result(timeout=0) is None
+
+
+def test_stop_kills_only_its_own_nspawn_stream():
+    container = MagicMock()
+    container.__getitem__.return_value = dict(client=object())
+    container.run.return_value = iter([])
+    first, second = EventListener(container), EventListener(container)
+    first.start()
+    second.start()
+    first.stop()
+
+    started = container.run.call_args_list[0][0][0]
+    [[[stopped], _]] = container.execute.call_args_list
+    pidfile = first.pidfile.format(first.marker)
+    assert 'echo $$ > {0}; exec salt-run state.event'.format(pidfile) in started
+    assert 'kill $(cat {0})'.format(pidfile) in stopped
+    assert second.marker not in stopped
+
+
+def test_container_removal_stops_events():
+    events = MagicMock()
+    container = ContainerModel(
+        type='docker', ip=None, ssh_config=None, events=events,
+        config=dict(name='master', client=MagicMock()))
+    container.remove()
+    reaper.drain()
+    assert events.stop.called
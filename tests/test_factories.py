@@ -1,4 +1,7 @@
 import pytest
+from mock import MagicMock
+from saltcontainers.factories import start_daemon
+from saltcontainers.utils import ExecResult
 
 
 pytestmark = pytest.mark.usefixtures('config')
@@ -114,16 +117,31 @@ def test_container_config__salt_config__sls(testdir):
             )
             file_root_dir = 'sls'
             assert file_root == "/etc/salt/" + file_root_dir
-            top_sls = yaml.load(
-                (salt_root / 'container-test' / file_root_dir / 'top.sls').read()
-            )
+            files = config['salt_config']['files']
+            top_sls = yaml.load(files[file_root_dir + '/top.sls'])
             assert top_sls['base']['some-minion-id'] == ['latest']
-            latest_sls = yaml.load(
-                (salt_root / 'container-test' / file_root_dir / 'latest.sls').read()
-            )
+            latest_sls = yaml.load(files[file_root_dir + '/latest.sls'])
             assert latest_sls['abc']['pkg.latest'][0]['name'] == 'some-package'
     """)
 
     result = testdir.runpytest('-v')
 
     result.stdout.fnmatch_lines(['*::test_sth PASSED'])
+
+
+@pytest.mark.parametrize('result, error', [
+    (None, 'did not run in time'),
+    (ExecResult(1, b'', b'boom', 0), 'exited with 1: '),
+    (ExecResult(None, b'', b'', 0), None),
+    (ExecResult(0, b'', b'', 0), None),
+])
+def test_start_daemon(result, error):
+    container = MagicMock()
+    container.__getitem__.return_value = dict(name='master')
+    container.execute.return_value = result
+    if error is None:
+        assert start_daemon(container, 'salt-master -d') is result
+    else:
+        with pytest.raises(AssertionError) as exc:
+            start_daemon(container, 'salt-master -d')
+        assert error in str(exc.value)
@@ -0,0 +1,148 @@
+import time
+import requests
+import pytest
+from saltcontainers.connections import connections
+from saltcontainers.factories import (
+    ContainerFactory, MasterFactory, MinionFactory)
+from fakeengine import FakeEngine, FakeNspawn
+from saltcontainers.networks import networks
+from saltcontainers.reaper import reaper
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    with FakeEngine() as engine:
+        monkeypatch.setenv('DOCKER_HOST', engine.url)
+        yield engine
+    connections.clear()
+
+
+@pytest.fixture
+def machines(monkeypatch):
+    with FakeNspawn() as machines:
+        monkeypatch.setenv('NSPAWN_HOST', machines.url)
+        yield machines
+    connections.clear()
+
+
+def salt_config(tmpdir, conf_type, **extra):
+    kwargs = dict(
+        container__config__image='fake/image',
+        container__config__salt_config__tmpdir=tmpdir,
+        container__config__salt_config__conf_type=conf_type)
+    kwargs.update(extra)
+    return kwargs
+
+
+def nspawn_container(tmpdir):
+    return ContainerFactory(
+        type='nspawn',
+        config__image='fake/image',
+        config__salt_config__tmpdir=tmpdir,
+        config__salt_config__conf_type='minion')
+
+
+def test_factories_against_fake_engine(engine, tmpdir):
+    master = MasterFactory(**salt_config(tmpdir, 'master'))
+    minion = MinionFactory(**salt_config(
+        tmpdir, 'minion',
+        container__config__salt_config__config={
+            'base_config': {'master': master['container']['ip']}}))
+
+    assert master.salt_key()['minions_pre'] == [minion['id']]
+    assert master.salt_key_accept_many([minion['id']]) == set([minion['id']])
+
+    for obj in [master, minion]:
+        obj['container'].remove()
+    assert reaper.drain() == []
+    assert engine.containers == {}
+    stats = engine.stats()
+    assert stats['create'] == stats['remove'] == 2
+    assert 'unknown' not in stats
+
+
+def test_nspawn_client_against_fake_machines(machines, tmpdir):
+    container = nspawn_container(tmpdir)
+    config = container['config']
+    assert container['ip'] == machines.containers[config['name']]['ip']
+    assert machines.stats() == dict(
+        clone=1, start=1, bind=1, inspect=1, run=1, total=5)
+
+    machines.reset()
+    config['client'].configure_salt(config)
+    assert machines.stats() == dict(copy_to=1, run=1, total=2)
+    assert machines.containers[config['name']]['salt'] == dict(
+        id=config['salt_config']['id'])
+
+    assert list(container.run('salt-call --version', stream=True)) == [
+        b'salt-call 2016.11.4 (Carbon)']
+    assert container.execute('salt-key -a x').exit_code == 0
+
+
+def test_nspawn_drop_waits_for_stop(machines, tmpdir):
+    machines.stop_delay = 0.2
+    container = nspawn_container(tmpdir)
+    client, name = container['config']['client'], container['config']['name']
+    assert client.state(name) == 'running'
+
+    machines.reset()
+    start = time.time()
+    client.drop(name)
+    assert 0.2 <= time.time() - start < 5
+    assert client.state(name) == 'gone'
+    assert 'run' not in machines.stats()
+
+
+def test_nspawn_drop_terminates_after_deadline(machines, tmpdir):
+    machines.stop_delay = None
+    container = nspawn_container(tmpdir)
+    client, name = container['config']['client'], container['config']['name']
+
+    machines.reset()
+    client.drop(name, deadline=0.1)
+    assert machines.stats()['run'] == 1
+    assert machines.stats()['remove'] == 1
+    assert name not in machines.containers
+
+
+def test_nspawn_drop_always_removes(machines, tmpdir):
+    container = nspawn_container(tmpdir)
+    client, name = container['config']['client'], container['config']['name']
+    machines.routes = [it for it in machines.routes if it[2] != 'stop']
+
+    with pytest.raises(requests.HTTPError):
+        client.drop(name, deadline=0.1)
+    assert name not in machines.containers
+
+
+def test_nspawn_force_remove_skips_the_stop(machines, tmpdir):
+    machines.stop_delay = None
+    container = nspawn_container(tmpdir)
+    client, name = container['config']['client'], container['config']['name']
+
+    machines.reset()
+    start = time.time()
+    client.force_remove(name)
+    assert time.time() - start < 1
+    assert machines.stats() == dict(run=1, remove=1, total=2)
+    assert name not in machines.containers
+
+
+def test_static_ips_skip_network_lookups_and_inspects(engine, tmpdir):
+    networks.static_ips = True
+    try:
+        master = MasterFactory(**salt_config(tmpdir, 'master'))
+        minion = MinionFactory(**salt_config(
+            tmpdir, 'minion',
+            container__config__salt_config__config={
+                'base_config': {'master': master['container']['ip']}}))
+    finally:
+        networks.static_ips = False
+        networks.clear()
+
+    assert master['container']['ip'] == '10.213.0.2'
+    assert minion['container']['ip'] == '10.213.0.3'
+    assert master.salt_key()['minions_pre'] == [minion['id']]
+    stats = engine.stats()
+    assert stats['networks'] == stats['create_network'] == 1
+    assert 'inspect' not in stats
@@ -0,0 +1,69 @@
+import time
+import threading
+from mock import MagicMock
+from saltcontainers.groups import ContainerGroup, MinionGroup, failures
+from saltcontainers.models import ContainerModel, MinionModel
+
+
+def minion_item(minion_id, salt_call):
+    container = ContainerModel(config=dict(name=minion_id, client=MagicMock()))
+    minion = MinionModel(id=minion_id, container=container)
+    minion.salt_call_once = MagicMock(side_effect=salt_call)
+    return dict(id=minion_id, fixture=minion)
+
+
+def test_minion_group_collects_results_and_errors():
+    lock = threading.Lock()
+    running = dict(now=0, max=0)
+
+    def salt_call(command):
+        with lock:
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+        time.sleep(0.05)
+        with lock:
+            running['now'] -= 1
+        return True
+
+    items = [minion_item('minion{0}'.format(i), salt_call) for i in range(6)]
+    items.append(minion_item('broken', ValueError('bad output')))
+    config = dict(masters=[
+        dict(id='master', minions=items[:3], syndics=[
+            dict(id='syndic', minions=items[3:], syndics=[])])])
+
+    group = MinionGroup.from_setup(config, workers=3)
+    results = group.salt_call('test.ping')
+
+    assert len(group) == 7
+    assert results['minion0'].value is True
+    assert results['minion5'].duration >= 0.05
+    assert list(failures(results)) == ['broken']
+    assert running['max'] == 3
+
+
+def test_container_group_run():
+    client = MagicMock()
+    client.run.side_effect = lambda name, command, stream: name
+    items = [
+        dict(id=name, fixture=ContainerModel(config=dict(name=name, client=client)))
+        for name in ['first', 'second']]
+
+    results = ContainerGroup.from_items(items).run('hostname')
+
+    assert dict((k, v.value) for k, v in results.items()) == dict(
+        first='first', second='second')
+    assert failures(results) == {}
+
+
+def test_container_group_reports_errors_at_once():
+    client = MagicMock()
+    client.run.side_effect = RuntimeError('exec failed')
+    items = [dict(id='first', fixture=ContainerModel(
+        config=dict(name='first', client=client)))]
+
+    start = time.time()
+    results = ContainerGroup.from_items(items).run('hostname')
+
+    assert time.time() - start < 1
+    assert str(results['first'].error) == 'exec failed'
+    assert client.run.call_count == 1
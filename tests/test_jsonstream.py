@@ -0,0 +1,40 @@
+from mock import MagicMock
+from saltcontainers.jsonstream import JSONStream, iter_json
+from saltcontainers.models import ContainerModel, MasterModel
+
+
+OUTPUT = (
+    u'[WARNING ] some noise\n'
+    u'{\n    "minion1": {"grains": {"os": "SUSE", "path": "C:\\\\x\\"{[", "n": [1, 2]}}\n}\n'
+    u'{\n    "minion2": {"uni": "\u00e9t\u00e9"}\n}\n'
+).encode('utf8')
+
+
+def test_stream_any_chunk_size():
+    expected = [
+        {'minion1': {'grains': {'os': 'SUSE', 'path': 'C:\\x"{[', 'n': [1, 2]}}},
+        {'minion2': {'uni': u'\u00e9t\u00e9'}}]
+    for size in [1, 2, 3, 7, len(OUTPUT)]:
+        chunks = [OUTPUT[i:i + size] for i in range(0, len(OUTPUT), size)]
+        assert list(iter_json(chunks)) == expected
+
+
+def test_stream_keeps_only_current_document():
+    stream = JSONStream()
+    assert stream.feed(b'{"a": 1}{"b": ') == [{'a': 1}]
+    assert stream.parts == ['{"b": ']
+    assert stream.feed(b'2}') == [{'b': 2}]
+    assert stream.parts == []
+
+
+def test_salt_iter():
+    client = MagicMock()
+    client.run.return_value = iter([OUTPUT[:40], OUTPUT[40:]])
+    master = MasterModel(
+        container=ContainerModel(config=dict(name='master', client=client)))
+
+    results = master.salt_iter('*', 'grains.item', 'os')
+
+    assert [it[0] for it in results] == ['minion1', 'minion2']
+    client.run.assert_called_once_with(
+        'master', "salt * grains.item os --output=json -l quiet", stream=True)
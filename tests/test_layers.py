@@ -0,0 +1,98 @@
+import io
+import py
+import pytest
+from mock import MagicMock
+from docker.errors import NotFound
+from saltcontainers.models import ContainerModel
+from saltcontainers.layers import LayerCache
+from saltcontainers.utils import ExecResult
+
+
+def container(tmpdir, images=None, image_id='sha256:abc', removed=0):
+    root = tmpdir.ensure_dir('master_abc')
+    files = {
+        'master': b'include: master.d/*\n',
+        'masterless': None,
+        'masterless/top.sls': b'base: {}\n'
+    }
+    client = MagicMock(**{
+        'images.return_value': images or [],
+        'inspect_image.return_value': dict(Id=image_id),
+        'get_archive.side_effect': lambda name, path: (
+            io.BytesIO(path.encode('utf8')), None),
+        'execute.side_effect': [
+            ExecResult(0, b'/var/run/salt-master.pid\n', b'', 0),
+            ExecResult(removed, b'', b'', 0)]})
+    return ContainerModel(
+        config=dict(
+            name='master_abc', image='image', client=client,
+            salt_config=dict(conf_type='master', root=root, files=files)))
+
+
+def test_layer_digest_follows_config_tree(tmpdir):
+    obj = container(tmpdir)
+    digest = LayerCache.digest(obj)
+    assert digest == LayerCache.digest(obj)
+    obj['config']['salt_config']['files']['masterless/top.sls'] = b'base: {"*": [a]}\n'
+    assert digest != LayerCache.digest(obj)
+
+
+def test_layer_digest_follows_base_image(tmpdir):
+    digest = LayerCache.digest(container(tmpdir))
+    assert digest != LayerCache.digest(container(tmpdir, image_id='sha256:def'))
+
+
+def test_layer_skipped_without_base_image(tmpdir):
+    obj = container(tmpdir)
+    obj['config']['client'].inspect_image.side_effect = NotFound(
+        'no image', MagicMock(status_code=404, reason='Not Found'))
+    LayerCache(enabled=True).lookup(obj)
+    assert 'layer' not in obj
+
+
+def test_layer_commit_then_lookup(tmpdir):
+    cache = LayerCache(enabled=True)
+    obj = container(tmpdir)
+    cache.lookup(obj)
+    assert obj['layer']['cached'] is False
+    assert obj['config']['image'] == 'image'
+    cache.commit(obj)
+    client = obj['config']['client']
+    client.commit.assert_called_once_with(
+        'master_abc', repository=cache.repository, tag=obj['layer']['tag'])
+    assert client.execute.call_args[0][1] == (
+        'rm -rf /etc/salt/pki /var/run/salt-master.pid')
+    # the running master gets its keys and pid file back
+    assert [it[0] for it in client.put_archive.call_args_list] == [
+        ('master_abc', '/etc/salt', b'/etc/salt/pki'),
+        ('master_abc', '/var/run', b'/var/run/salt-master.pid')]
+
+    other = container(py.path.local(tmpdir.mkdir('other')))
+    cache.lookup(other)
+    assert other['layer']['cached'] is True
+    assert other['config']['image'] == '{0}:{1}'.format(
+        cache.repository, obj['layer']['tag'])
+
+
+def test_layer_cache_disabled(tmpdir):
+    obj = container(tmpdir)
+    LayerCache().lookup(obj)
+    assert 'layer' not in obj
+
+
+@pytest.mark.parametrize('removed', [1, None])
+def test_layer_not_committed_with_keys(tmpdir, removed):
+    cache = LayerCache(enabled=True)
+    obj = container(tmpdir, removed=removed)
+    cache.lookup(obj)
+    cache.commit(obj)
+    client = obj['config']['client']
+    assert not client.commit.called
+    assert client.put_archive.call_count == 2
+
+
+def test_layer_cache_skips_syndics(tmpdir):
+    obj = container(tmpdir)
+    obj['config']['salt_config']['layer_cache'] = False
+    LayerCache(enabled=True).lookup(obj)
+    assert 'layer' not in obj
@@ -0,0 +1,57 @@
+import json
+import shlex
+import subprocess
+from mock import MagicMock
+from saltcontainers.models import ContainerModel, MasterModel
+from saltcontainers.utils import ExecResult
+
+
+def master(client):
+    return MasterModel(
+        container=ContainerModel(config=dict(name='master_abc', client=client)))
+
+
+def test_salt_key_accept_many():
+    client = MagicMock()
+    client.run.side_effect = [
+        json.dumps(dict(minions_pre=['id_a', 'id_b'], minions=[])),
+        '',
+        json.dumps(dict(minions_pre=[], minions=['id_a', 'id_b']))]
+    obj = master(client)
+
+    assert obj.salt_key_accept_many(['id_a', 'id_b']) == set(['id_a', 'id_b'])
+
+    commands = [it[0][1] for it in client.run.call_args_list]
+    assert commands == [
+        'salt-key --output=json',
+        'salt-key -a id_a,id_b -y --output=json',
+        'salt-key --output=json']
+
+
+class LocalClient(object):
+    """
+    Run exec commands on the local shell.
+    """
+
+    def __init__(self):
+        self.commands = []
+
+    def execute(self, name, command):
+        self.commands.append(command)
+        proc = subprocess.Popen(
+            shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        return ExecResult(proc.returncode, out, err, 0)
+
+
+def test_run_many_single_exec():
+    client = LocalClient()
+    container = ContainerModel(config=dict(name='local', client=client))
+
+    results = container.run_many([
+        'echo one', 'echo "two" >&2; exit 3', "echo 'th ree'"])
+
+    assert len(client.commands) == 1
+    assert [it.exit_code for it in results] == [0, 3, 0]
+    assert [it.stdout for it in results] == [b'one\n', b'', b'th ree\n']
+    assert results[1].stderr == b'two\n'
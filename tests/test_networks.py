@@ -0,0 +1,93 @@
+import pytest
+from mock import MagicMock
+from saltcontainers.clients import NspawnClient
+from saltcontainers.networks import (
+    IPAllocator, NetworkManager, ip_to_int, static_ip)
+
+
+def test_allocator_skips_gateway_and_reserved():
+    allocator = IPAllocator('10.1.0.0/29', reserved=['10.1.0.3'])
+    assert [allocator.allocate() for _ in range(4)] == [
+        '10.1.0.2', '10.1.0.4', '10.1.0.5', '10.1.0.6']
+    with pytest.raises(RuntimeError):
+        allocator.allocate()
+    allocator.release('10.1.0.4')
+    assert allocator.allocate() == '10.1.0.4'
+
+
+def test_allocator_shards():
+    first = IPAllocator('10.1.0.0/24', offset=0, stride=2)
+    second = IPAllocator('10.1.0.0/24', offset=1, stride=2)
+    assert [first.allocate() for _ in range(2)] == ['10.1.0.2', '10.1.0.4']
+    assert [second.allocate() for _ in range(2)] == ['10.1.0.3', '10.1.0.5']
+
+
+def test_manager_looks_networks_up_once():
+    client = MagicMock()
+    client.networks.return_value = [dict(Name='network10')]
+    client.create_endpoint_config.side_effect = dict
+    manager = NetworkManager(subnet='10.2.0.0/24', static_ips=True)
+
+    first = manager.endpoint_config(client, 'network1', 'bridge')
+    second = manager.endpoint_config(client, 'network1', 'bridge')
+
+    assert client.networks.call_count == 1
+    assert client.create_network.call_count == 1
+    assert client.create_network.call_args[1]['ipam']['Config'][0][
+        'Subnet'] == '10.2.0.0/24'
+    assert first == dict(IPAMConfig=dict(IPv4Address='10.2.0.2'))
+    assert second == dict(IPAMConfig=dict(IPv4Address='10.2.0.3'))
+
+    config = dict(
+        client=client, networking_config=dict(EndpointsConfig=dict(network1=first)))
+    assert static_ip(config) == '10.2.0.2'
+    assert static_ip(dict(config, networking_config=manager.renew(config))) == (
+        '10.2.0.4')
+    manager.release(config)
+    allocator = manager.ensure(client, 'network1')
+    assert allocator.next == allocator.first + 3
+    assert ip_to_int('10.2.0.2') not in allocator.used
+
+
+def test_manager_reuses_existing_network_addresses():
+    client = MagicMock()
+    client.networks.return_value = [dict(
+        Name='network1', Id='n1',
+        IPAM=dict(Config=[dict(Subnet='10.3.0.0/24')]))]
+    client.inspect_network.return_value = dict(Containers=dict(
+        c1=dict(IPv4Address='10.3.0.2/24')))
+    client.create_endpoint_config.side_effect = dict
+    manager = NetworkManager(subnet='10.3.0.0/24', static_ips=True)
+
+    endpoint = manager.endpoint_config(client, 'network1')
+
+    assert not client.create_network.called
+    assert endpoint['IPAMConfig']['IPv4Address'] == '10.3.0.3'
+
+
+def test_manager_leaves_docker_assigned_subnets_to_docker():
+    client = MagicMock()
+    client.networks.return_value = [dict(
+        Name='network1', Id='n1',
+        IPAM=dict(Config=[dict(Subnet='172.18.0.0/16')]))]
+    client.create_endpoint_config.side_effect = dict
+    manager = NetworkManager(static_ips=True)
+
+    assert manager.endpoint_config(client, 'network1') == dict()
+    assert not client.inspect_network.called
+
+
+def test_manager_static_ips_with_nspawn():
+    manager = NetworkManager(static_ips=True)
+    client = NspawnClient('http+unix:///var/run/gunicorn.sock')
+    assert manager.endpoint_config(client, 'network1') == dict()
+
+
+def test_manager_without_static_ips():
+    client = MagicMock()
+    client.networks.return_value = [dict(Name='network1')]
+    client.create_endpoint_config.side_effect = dict
+    manager = NetworkManager()
+
+    assert manager.endpoint_config(client, 'network1') == dict()
+    assert not client.create_network.called
@@ -0,0 +1,86 @@
+import pytest
+from mock import MagicMock
+from saltcontainers.models import ContainerModel
+from saltcontainers.pool import ContainerPool, RESET_COMMAND
+from saltcontainers.reaper import reaper
+from saltcontainers.utils import ExecResult
+
+
+def container(name='master_abc', client=None, reset_code=0):
+    client = client or MagicMock(**{
+        'getip.return_value': 'fake-ip',
+        'execute.return_value': ExecResult(reset_code, b'', b'', 0)})
+    return ContainerModel(
+        type='docker',
+        ip=None,
+        ssh_config=None,
+        config=dict(
+            name=name, image='image', client=client,
+            salt_config=dict(conf_type='master')))
+
+
+def test_pool_disabled():
+    pool = ContainerPool()
+    obj = container()
+    pool.fill(obj)
+    assert not pool.checkout(obj)
+    assert not obj['config']['client'].create_container.called
+
+
+def test_pool_checkout_and_recycle():
+    pool = ContainerPool(size=1)
+    template = container()
+    pool.fill(template)
+
+    client = template['config']['client']
+    obj = container(client=client)
+    assert pool.checkout(obj)
+    assert obj['config']['name'].startswith('master_pool_')
+    assert obj['ip'] == 'fake-ip'
+
+    pool.executor.shutdown()
+    assert client.create_container.call_count == 2
+    obj.remove()
+    reaper.drain()
+    assert client.execute.call_args[0][1] == RESET_COMMAND
+    assert client.force_remove.call_count == 1
+    pool.clear()
+    reaper.drain()
+    assert client.force_remove.call_count == 2
+
+
+@pytest.mark.parametrize('reset_code, recycled', [(0, True), (1, False)])
+def test_pool_recycles_only_clean_containers(reset_code, recycled):
+    pool = ContainerPool(size=1)
+    template = container(reset_code=reset_code)
+    pool.fill(template)
+
+    obj = container(client=template['config']['client'])
+    assert pool.checkout(obj)
+    pool.executor.shutdown()
+    # room for the released container, it would be recycled if clean
+    pool.clear()
+    reaper.drain()
+    obj.remove()
+    reaper.drain()
+    assert template['config']['client'].force_remove.call_count == (
+        1 if recycled else 2)
+    assert bool(pool.idle) == recycled
+    pool.clear()
+    reaper.drain()
+
+
+def test_pool_key_covers_container_settings():
+    obj = container()
+    other = container(name='master_def')
+    assert ContainerPool.key(obj) == ContainerPool.key(other)
+    other['config']['environment'] = dict(FOO='bar')
+    assert ContainerPool.key(obj) != ContainerPool.key(other)
+
+
+def test_pool_skips_ssh_containers():
+    pool = ContainerPool(size=1)
+    obj = container()
+    obj['ssh_config'] = dict(user='root', password='admin123')
+    pool.fill(obj)
+    assert not pool.idle
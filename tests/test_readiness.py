@@ -0,0 +1,94 @@
+import socket
+import pytest
+from mock import MagicMock
+from saltcontainers.readiness import Readiness, established, port_open
+from saltcontainers.utils import ExecResult
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(5)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+def closed_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def salt_obj(config, exit_codes=(0,)):
+    container = MagicMock()
+    container.__getitem__.side_effect = dict(
+        ip='127.0.0.1',
+        config=dict(name='c1', salt_config=dict(config=config))).__getitem__
+    container.execute.side_effect = [
+        ExecResult(it, b'', b'', 0) for it in exit_codes]
+    return dict(id='id1', container=container)
+
+
+def test_port_open(listener):
+    assert port_open('127.0.0.1', listener)
+    assert not port_open('127.0.0.1', closed_port())
+
+
+def test_master_ready_on_configured_ports(listener):
+    readiness = Readiness(enabled=True, deadline=0.2)
+    obj = salt_obj(dict(base_config=dict(
+        publish_port=listener, ret_port=listener)))
+    readiness.wait(obj, 'master')
+
+    obj = salt_obj(dict(base_config=dict(
+        publish_port=listener, ret_port=closed_port())))
+    with pytest.raises(AssertionError):
+        readiness.wait(obj, 'master')
+
+
+def test_minion_waits_for_pidfile_and_master_connection():
+    readiness = Readiness(enabled=True, deadline=1)
+    obj = salt_obj(
+        dict(base_config=dict(master='10.0.0.1', master_port=4606)),
+        exit_codes=(1, 0, 1, 0))
+    readiness.wait(obj, 'minion')
+    # one exec per probe window, each polling inside the container
+    commands = [it[0][0] for it in obj['container'].execute.call_args_list]
+    assert len(commands) == 4
+    assert 'until test -s /var/run/salt-minion.pid;' in commands[1]
+    assert '-ge 10 ]' in commands[1]
+    assert established('10.0.0.1', 4606) in commands[3]
+
+    obj = salt_obj(dict(base_config=dict(master='10.0.0.1')), exit_codes=(0, 1))
+    with pytest.raises(AssertionError):
+        Readiness(enabled=True, deadline=0.01).wait(obj, 'minion')
+
+
+def test_established_matches_both_byte_orders():
+    assert established('10.0.0.1', 4506) == (
+        'grep -qE " (0100000A|0A000001):119A 01 " /proc/net/tcp')
+
+
+def test_syndic_waits_for_connection_to_master():
+    readiness = Readiness(enabled=True, deadline=1)
+    obj = salt_obj(
+        dict(base_config=dict(syndic_master='10.0.0.1')), exit_codes=(0, 1, 0))
+    readiness.wait(obj, 'syndic')
+    commands = [it[0][0] for it in obj['container'].execute.call_args_list]
+    assert 'salt-syndic.pid' in commands[0]
+    assert commands[1] == commands[2]
+    assert established('10.0.0.1', 4506) in commands[2]
+
+    obj = salt_obj(
+        dict(base_config=dict(syndic_master='10.0.0.1')), exit_codes=(0, 1))
+    with pytest.raises(AssertionError):
+        Readiness(enabled=True, deadline=0.01).wait(obj, 'syndic')
+
+
+def test_disabled_readiness_probes_nothing():
+    obj = salt_obj(dict())
+    Readiness().wait(obj, 'syndic')
+    assert not obj['container'].execute.called
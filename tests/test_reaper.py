@@ -0,0 +1,23 @@
+from mock import MagicMock
+from saltcontainers.models import ContainerModel
+from saltcontainers.reaper import Reaper
+
+
+def container(name, client):
+    return ContainerModel(config=dict(name=name, client=client))
+
+
+def test_reaper_force_removes_and_reports_failures():
+    client = MagicMock()
+    client.force_remove.side_effect = lambda name: name == 'broken' and 1 / 0
+    reaper = Reaper(workers=2)
+    for name in ['first', 'broken', 'second']:
+        reaper.reap(container(name, client))
+
+    failures = reaper.drain()
+
+    assert [it[0] for it in failures] == ['broken']
+    assert sorted(it[0][0] for it in client.force_remove.call_args_list) == [
+        'broken', 'first', 'second']
+    assert not client.stop.called
+    assert reaper.drain() == []
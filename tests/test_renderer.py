@@ -0,0 +1,97 @@
+import io
+import tarfile
+import yaml
+from mock import MagicMock
+from requests.utils import super_len
+from saltcontainers.factories import ContainerConfigFactory
+from saltcontainers.renderer import ConfigRenderer, LRUCache, renderer
+
+
+def salt_config(tmpdir, **kwargs):
+    return ContainerConfigFactory(
+        name='master_abc',
+        client=MagicMock(),
+        networking_config=dict(name='network1', driver='bridge'),
+        salt_config__tmpdir=tmpdir,
+        salt_config__conf_type='master',
+        salt_config__config={'base_config': {'hash_type': 'sha384'}},
+        salt_config__pillar={'data': {'key': 'value'}},
+        **kwargs)['salt_config']
+
+
+def test_salt_config_rendered_in_memory(tmpdir):
+    config = salt_config(tmpdir)
+    assert not config['root'].listdir()
+    assert yaml.safe_load(config['files']['master']) == {'include': 'master.d/*'}
+
+    with tarfile.open(fileobj=renderer.archive(config)) as archive:
+        assert archive.getmember('./master.d').isdir()
+        assert archive.getmember('./sls').isdir()
+        base_config = archive.extractfile('./master.d/base_config.conf').read()
+        pillar = archive.extractfile('./pillar/data.sls').read()
+    assert yaml.safe_load(base_config) == {'hash_type': 'sha384'}
+    assert yaml.safe_load(pillar) == {'key': 'value'}
+
+
+def test_salt_config_kept_on_disk(tmpdir, monkeypatch):
+    monkeypatch.setattr(renderer, 'keep_files', True)
+    config = salt_config(tmpdir)
+    root = config['root']
+    assert yaml.safe_load((root / 'pillar' / 'data.sls').read()) == {'key': 'value'}
+    assert (root / 'sls').check(dir=True)
+
+
+def test_archive_spools_to_disk_when_large():
+    obj = ConfigRenderer()
+    obj.spool_size = 10
+    archive = obj.archive(dict(files={'big': b'x' * 100}))
+    archive.seek(0, io.SEEK_END)
+    # past max_size SpooledTemporaryFile rolls over to a file on disk
+    assert archive.tell() > obj.spool_size
+
+
+def test_archive_in_memory_when_small():
+    obj = ConfigRenderer()
+    archive = obj.archive(dict(files={'small': b'x' * 100}))
+    assert isinstance(archive, io.BytesIO)
+    # what requests does with an upload body
+    assert super_len(archive) == len(archive.getvalue())
+
+
+def test_archive_past_spool_size_not_cached():
+    obj = ConfigRenderer()
+    obj.spool_size = 10
+    config = dict(files={'big': b'x' * 100})
+    first = obj.archive(config).read()
+    assert obj.archive(config).read() == first
+    assert obj.cache.hits == 0
+
+
+def test_identical_trees_share_archive(tmpdir):
+    obj = ConfigRenderer()
+    files = {'master': obj.dump({'include': 'master.d/*'}), 'master.d': None}
+    first = obj.archive(dict(files=files)).read()
+    hits = obj.cache.hits
+    assert obj.archive(dict(files=dict(files))).read() == first
+    assert obj.cache.hits == hits + 1
+
+
+def test_sls_source_reread_when_modified(tmpdir):
+    obj = ConfigRenderer()
+    source = tmpdir / 'top.sls'
+    source.write('base: {}\n')
+    assert obj.read(source.strpath) == b'base: {}\n'
+    source.write('base: {"*": [a]}\n')
+    source.setmtime(source.mtime() + 10)
+    assert obj.read(source.strpath) == b'base: {"*": [a]}\n'
+
+
+def test_lru_cache_size_limit():
+    cache = LRUCache(10)
+    cache.set('a', b'12345')
+    cache.set('b', b'12345')
+    cache.get('a')
+    cache.set('c', b'12345')
+    assert cache.get('a') == b'12345'
+    assert cache.get('b') is None
+    assert cache.size == 10
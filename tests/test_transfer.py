@@ -0,0 +1,52 @@
+import io
+import tarfile
+from mock import MagicMock
+from saltcontainers.groups import ContainerGroup
+from saltcontainers.models import ContainerModel
+from saltcontainers.transfer import Payload, file_digest
+from saltcontainers.utils import ExecResult
+
+
+def container(name, existing):
+    client = MagicMock()
+    client.execute.return_value = ExecResult(
+        1, ''.join('{0}  {1}\n'.format(v, k) for k, v in existing.items()).encode(),
+        b'sha1sum: missing', 0)
+    return ContainerModel(config=dict(name=name, client=client))
+
+
+def sent(obj):
+    [call] = obj['config']['client'].put_archive.call_args_list
+    name, path, data = call[0]
+    assert path == '/'
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        return data, sorted(archive.getnames())
+
+
+def test_sync_to_skips_files_already_there(tmpdir):
+    sls = tmpdir.ensure_dir('sls')
+    sls.join('top.sls').write('base: {}\n')
+    sls.ensure('pkg', 'init.sls').write('pkg: {}\n')
+    payload = Payload.from_dir(sls.strpath, '/srv/salt')
+    obj = container('minion', {
+        '/srv/salt/top.sls': file_digest(sls.join('top.sls').strpath)})
+
+    assert obj.sync_to(payload) == ['/srv/salt/pkg/init.sls']
+    assert sent(obj)[1] == ['srv/salt/pkg/init.sls']
+    command = obj['config']['client'].execute.call_args[0][1]
+    assert command == 'sha1sum -- /srv/salt/pkg/init.sls /srv/salt/top.sls'
+
+
+def test_group_sync_builds_one_archive(tmpdir):
+    source = tmpdir.join('grains')
+    source.write('role: web\n')
+    items = [
+        dict(id=name, fixture=container(name, {})) for name in ['a', 'b', 'c']]
+
+    results = ContainerGroup.from_items(items).sync_to(
+        [(source.strpath, '/etc/salt/grains')])
+
+    assert [results[it].value for it in 'abc'] == [['/etc/salt/grains']] * 3
+    archives = [sent(it['fixture']) for it in items]
+    assert archives[0][1] == ['etc/salt/grains']
+    assert archives[0][0] is archives[1][0] is archives[2][0]
@@ -0,0 +1,53 @@
+import time
+from saltcontainers.utils import RetryPolicy, retry, retry_stats, wait_for
+
+
+FAST = RetryPolicy(deadline=1, fast_polls=2, fast_interval=0, interval=0.001)
+
+
+def test_retry_policy_delays():
+    policy = RetryPolicy(
+        fast_polls=2, fast_interval=0.05, interval=0.1, factor=2,
+        max_interval=0.3, jitter=0)
+    delays = policy.delays()
+    assert [next(delays) for _ in range(6)] == [0.05, 0.05, 0.1, 0.2, 0.3, 0.3]
+
+
+def test_retry_until_expected():
+    calls = []
+
+    @retry(expected=True, policy=FAST)
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ValueError('not yet')
+        return True
+
+    retry_stats.reset()
+    assert flaky() is True
+    [stats] = retry_stats.report().values()
+    assert stats['calls'] == 1
+    assert stats['attempts'] == 3
+    assert stats['failures'] == 0
+
+
+def test_wait_for_predicate():
+    values = iter([None, '', 'ready'])
+    assert wait_for(lambda: next(values), policy=FAST, name='probe') == 'ready'
+    assert retry_stats.report()['probe']['attempts'] == 3
+
+
+def test_wait_for_deadline():
+    assert not wait_for(lambda: False, deadline=0.01, policy=FAST)
+
+
+def test_wait_for_stops_at_deadline():
+    slow = RetryPolicy(fast_polls=0, interval=5, jitter=0)
+    retry_stats.reset()
+    start = time.time()
+    assert not wait_for(lambda: False, deadline=0.2, policy=slow, name='slow')
+    assert time.time() - start < 1
+    stats = retry_stats.report()['slow']
+    # one attempt right away, the last one at the deadline, no sleep after it
+    assert stats['attempts'] == 2
+    assert stats['slept'] <= 0.2